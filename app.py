@@ -2,13 +2,41 @@
 캡챠 API 서버 - Polling 방식 (WebSocket 제거)
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, Response, stream_with_context, g, has_request_context
 from flask_cors import CORS
 import psycopg
+from psycopg import sql
 from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import ConnectionPool, PoolTimeout
+from werkzeug.http import parse_accept_header
 import os
+import sys
+import threading
+import atexit
+import time
 from datetime import datetime, timedelta
 import hashlib
+import hmac
+import secrets
+import functools
+import re
+import random
+import itertools
+import queue
+import contextvars
+import json
+import csv
+import io
+import base64
+import binascii
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:  # 없으면 gzip 만 사용
+    brotli = None
 
 app = Flask(__name__)
 CORS(app, origins="*")
@@ -16,16 +44,177 @@ CORS(app, origins="*")
 DATABASE_URL = os.environ.get('DATABASE_URL')
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin1234')
 
+# ==================== 메트릭 (Prometheus) ====================
+# 멀티 프로세스(gunicorn/uvicorn 워커 여러 개)에서는 PROMETHEUS_MULTIPROC_DIR 에 프로세스별로 기록하고
+# /metrics 에서 합산한다 (gunicorn.conf.py 참고). prometheus_client 가 없으면 기록하지 않음.
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Histogram
+except ImportError:
+    prometheus_client = None
+
+DB_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+
+if prometheus_client:
+    REQUEST_COUNT = Counter('cap_api_requests_total', 'HTTP 요청 수', ['method', 'route', 'status'])
+    REQUEST_LATENCY = Histogram('cap_api_request_duration_seconds', 'HTTP 요청 처리 시간', ['method', 'route'],
+                                buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+    DB_QUERY_LATENCY = Histogram('cap_api_db_query_duration_seconds', 'DB 쿼리 실행 시간',
+                                 ['operation', 'table'], buckets=DB_BUCKETS)
+    DB_CONNECT_LATENCY = Histogram('cap_api_db_connect_duration_seconds', '새 DB 커넥션 연결 시간', buckets=DB_BUCKETS)
+    DB_ACQUIRE_LATENCY = Histogram('cap_api_db_pool_acquire_duration_seconds', '풀에서 커넥션을 얻기까지 대기 시간',
+                                   buckets=DB_BUCKETS)
+
+_QUERY_TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+([A-Za-z_][A-Za-z0-9_]*)', re.IGNORECASE)
+_QUERY_WRITE_RE = re.compile(r'\b(INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=1024)
+def query_labels(query):
+    """SQL → (operation, table) 라벨 (WITH ... 는 안쪽의 쓰기 문장 기준)"""
+    words = query.split(None, 1)
+    operation = words[0].upper() if words else '-'
+    if operation == 'WITH':
+        write = _QUERY_WRITE_RE.search(query)
+        operation = write.group(1).upper() if write else 'SELECT'
+    table = _QUERY_TABLE_RE.search(query)
+    return operation, table.group(1).lower() if table else '-'
+
+
+def observe_query(query, elapsed):
+    if prometheus_client and query != '':  # '' 는 풀의 헬스 체크
+        labels = query_labels(query) if isinstance(query, str) else ('COMPOSED', '-')
+        DB_QUERY_LATENCY.labels(*labels).observe(elapsed)
+
+
+def observe_db_connect(elapsed):
+    if prometheus_client:
+        DB_CONNECT_LATENCY.observe(elapsed)
+
+
+def observe_db_acquire(elapsed):
+    if prometheus_client:
+        DB_ACQUIRE_LATENCY.observe(elapsed)
+
+
+def observe_request(method, route, status, elapsed):
+    if prometheus_client:
+        REQUEST_COUNT.labels(method, route, status).inc()
+        REQUEST_LATENCY.labels(method, route).observe(elapsed)
+
+
+class TimedCursor(psycopg.Cursor):
+    """execute 마다 실행 시간 기록 (느린 쿼리는 trace_query 로)"""
+
+    def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            observe_query(query, elapsed)
+            trace_query(self, query, params, elapsed)
+
+    def executemany(self, query, params_seq, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, params_seq, **kwargs)
+        finally:
+            observe_query(query, time.perf_counter() - start)
+
+
+class TimedConnection(psycopg.Connection):
+    """새 커넥션 연결 시간 기록"""
+
+    @classmethod
+    def connect(cls, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().connect(*args, **kwargs)
+        finally:
+            observe_db_connect(time.perf_counter() - start)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        observe_request(request.method, route, response.status_code, time.perf_counter() - started)
+    return response
+
+
+# 커넥션 풀 설정 (gunicorn 워커 프로세스마다 풀 1개)
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))  # 커넥션 획득 대기 (초)
+DB_POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800))  # 커넥션 최대 수명 (초)
+DB_POOL_MAX_IDLE = float(os.environ.get('DB_POOL_MAX_IDLE', 300))  # 유휴 커넥션 정리 (초)
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """프로세스 공용 커넥션 풀 (최초 사용 시 생성, fork 후에는 새로 생성)"""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(
+                    DATABASE_URL,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    max_idle=DB_POOL_MAX_IDLE,
+                    connection_class=TimedConnection,
+                    kwargs={'row_factory': dict_row, 'cursor_factory': TimedCursor},
+                    check=ConnectionPool.check_connection,  # 꺼내기 전 헬스 체크
+                    name='cap_api',
+                    open=True,
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
 
 def get_db():
-    return psycopg.connect(DATABASE_URL, row_factory=dict_row)
+    """풀에서 커넥션 획득 (사용 후 반드시 release_db)"""
+    pool = get_pool()
+    start = time.perf_counter()
+    try:
+        return pool.getconn()
+    finally:
+        observe_db_acquire(time.perf_counter() - start)
 
 
-def init_db():
-    conn = get_db()
-    cur = conn.cursor()
-    
-    cur.execute('''
+def release_db(conn):
+    """커넥션 풀에 반환 (커밋 안 된 조회 트랜잭션은 롤백)"""
+    if conn.info.transaction_status == psycopg.pq.TransactionStatus.INTRANS:
+        conn.rollback()
+    get_pool().putconn(conn)
+
+
+@app.errorhandler(PoolTimeout)
+def pool_timeout(e):
+    return jsonify({'success': False, 'message': 'DB 연결 대기 시간 초과'}), 503
+
+
+# ==================== 스키마 마이그레이션 ====================
+# (버전, 설명, SQL 목록) - 적용된 버전은 schema_version 에 기록되어 다시 실행되지 않음.
+# 스키마를 바꿀 때는 기존 항목을 고치지 말고 항상 맨 뒤에 새 버전을 추가할 것.
+MIGRATIONS = [
+    (1, '기본 테이블', [
+        '''
         CREATE TABLE IF NOT EXISTS users (
             id SERIAL PRIMARY KEY,
             user_id VARCHAR(50) UNIQUE NOT NULL,
@@ -42,24 +231,20 @@ def init_db():
             is_approved BOOLEAN DEFAULT FALSE,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
-    # 기존 테이블에 컬럼 추가 (이미 테이블이 있을 경우)
-    cur.execute('''
-        DO $$ 
-        BEGIN
-            BEGIN ALTER TABLE users ADD COLUMN name VARCHAR(50); EXCEPTION WHEN duplicate_column THEN NULL; END;
-            BEGIN ALTER TABLE users ADD COLUMN phone VARCHAR(20); EXCEPTION WHEN duplicate_column THEN NULL; END;
-            BEGIN ALTER TABLE users ADD COLUMN email VARCHAR(100); EXCEPTION WHEN duplicate_column THEN NULL; END;
-            BEGIN ALTER TABLE users ADD COLUMN bank_name VARCHAR(50); EXCEPTION WHEN duplicate_column THEN NULL; END;
-            BEGIN ALTER TABLE users ADD COLUMN bank_account VARCHAR(50); EXCEPTION WHEN duplicate_column THEN NULL; END;
-            BEGIN ALTER TABLE users ADD COLUMN account_holder VARCHAR(50); EXCEPTION WHEN duplicate_column THEN NULL; END;
-            BEGIN ALTER TABLE users ADD COLUMN is_approved BOOLEAN DEFAULT FALSE; EXCEPTION WHEN duplicate_column THEN NULL; END;
-            BEGIN ALTER TABLE users ADD COLUMN point_per_solve INTEGER DEFAULT 10; EXCEPTION WHEN duplicate_column THEN NULL; END;
-        END $$;
-    ''')
-    
-    cur.execute('''
+        ''',
+        # 예전 버전에서 만들어진 테이블에 컬럼 추가
+        '''
+        ALTER TABLE users
+            ADD COLUMN IF NOT EXISTS name VARCHAR(50),
+            ADD COLUMN IF NOT EXISTS phone VARCHAR(20),
+            ADD COLUMN IF NOT EXISTS email VARCHAR(100),
+            ADD COLUMN IF NOT EXISTS bank_name VARCHAR(50),
+            ADD COLUMN IF NOT EXISTS bank_account VARCHAR(50),
+            ADD COLUMN IF NOT EXISTS account_holder VARCHAR(50),
+            ADD COLUMN IF NOT EXISTS is_approved BOOLEAN DEFAULT FALSE,
+            ADD COLUMN IF NOT EXISTS point_per_solve INTEGER DEFAULT 10
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS uid_queue (
             id SERIAL PRIMARY KEY,
             uid VARCHAR(100) UNIQUE NOT NULL,
@@ -67,11 +252,22 @@ def init_db():
             store_url VARCHAR(500),
             keyword VARCHAR(100),
             status VARCHAR(20) DEFAULT 'pending',
+            lease_owner VARCHAR(50),
+            lease_expires_at TIMESTAMP,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
-    cur.execute('''
+        ''',
+        '''
+        ALTER TABLE uid_queue
+            ADD COLUMN IF NOT EXISTS lease_owner VARCHAR(50),
+            ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP
+        ''',
+        # 리스 없이 processing 에 묶여 있던 UID 도 만료되면 회수되도록
+        '''
+        UPDATE uid_queue SET lease_expires_at = LOCALTIMESTAMP + INTERVAL '5 minutes'
+        WHERE status = 'processing' AND lease_expires_at IS NULL
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS results (
             id SERIAL PRIMARY KEY,
             task_id INTEGER,
@@ -88,9 +284,8 @@ def init_db():
             memo TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
-    cur.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS rewards_history (
             id SERIAL PRIMARY KEY,
             user_id VARCHAR(50) NOT NULL,
@@ -98,9 +293,8 @@ def init_db():
             reason VARCHAR(200),
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
-    cur.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS withdrawals (
             id SERIAL PRIMARY KEY,
             user_id VARCHAR(50) NOT NULL,
@@ -111,9 +305,8 @@ def init_db():
             status VARCHAR(20) DEFAULT 'pending',
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
-    cur.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS keywords (
             id SERIAL PRIMARY KEY,
             keyword VARCHAR(100) NOT NULL,
@@ -124,28 +317,808 @@ def init_db():
             status VARCHAR(20) DEFAULT 'pending',
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
-    # 작업 세션 (작업자 상태 관리)
-    cur.execute('''
+        ''',
+        # 작업 세션 (작업자 상태 관리)
+        # version 은 전역 시퀀스라 세션을 새로 만들어도 이전 값과 겹치지 않음
+        'CREATE SEQUENCE IF NOT EXISTS work_sessions_version_seq',
+        '''
         CREATE TABLE IF NOT EXISTS work_sessions (
             id SERIAL PRIMARY KEY,
             user_id VARCHAR(50) UNIQUE NOT NULL,
             current_uid_id INTEGER,
             screenshot TEXT,
+            screenshot_hash VARCHAR(64),
             answer VARCHAR(100),
             message VARCHAR(200),
+            version BIGINT DEFAULT nextval('work_sessions_version_seq'),
             last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
-    conn.commit()
-    cur.close()
-    conn.close()
+        ''',
+        '''
+        ALTER TABLE work_sessions
+            ADD COLUMN IF NOT EXISTS version BIGINT DEFAULT nextval('work_sessions_version_seq'),
+            ADD COLUMN IF NOT EXISTS screenshot_hash VARCHAR(64)
+        ''',
+        # 스크린샷 원본 (sha256 으로 주소 지정, work_sessions 는 해시만 보관)
+        '''
+        CREATE TABLE IF NOT EXISTS screenshots (
+            hash VARCHAR(64) PRIMARY KEY,
+            data BYTEA NOT NULL,
+            mime_type VARCHAR(50),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (2, '자주 쓰는 쿼리 인덱스', [
+        # lease_uids: pending 중 오래된 것부터
+        "CREATE INDEX IF NOT EXISTS idx_uid_queue_pending ON uid_queue (created_at, id) WHERE status = 'pending'",
+        # reclaim_expired_uids
+        "CREATE INDEX IF NOT EXISTS idx_uid_queue_lease ON uid_queue (lease_expires_at) WHERE status = 'processing'",
+        # get_pending_keyword
+        "CREATE INDEX IF NOT EXISTS idx_keywords_pending ON keywords (priority DESC, created_at) WHERE status = 'pending' AND is_active",
+        # 활성 세션 수
+        'CREATE INDEX IF NOT EXISTS idx_work_sessions_last_activity ON work_sessions (last_activity)',
+        # 결과 목록 (키셋 페이지네이션), 오늘 결과 수
+        'CREATE INDEX IF NOT EXISTS idx_results_created_id ON results (created_at, id)',
+        'CREATE INDEX IF NOT EXISTS idx_rewards_history_user ON rewards_history (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_withdrawals_status ON withdrawals (status, created_at)',
+    ]),
+    (3, '결과 목록 키셋 페이지네이션 인덱스', [
+        # 지금은 2 에서 만들므로 아무 일도 하지 않음 (예전 2 를 적용한 DB 만 created_at 단일 인덱스를 정리)
+        'CREATE INDEX IF NOT EXISTS idx_results_created_id ON results (created_at, id)',
+        'DROP INDEX IF EXISTS idx_results_created_at',
+    ]),
+    (4, '대시보드 집계 공유 캐시', [
+        '''
+        CREATE UNLOGGED TABLE IF NOT EXISTS dashboard_cache (
+            name VARCHAR(50) PRIMARY KEY,
+            data JSONB NOT NULL,
+            computed_at TIMESTAMP NOT NULL
+        )
+        ''',
+    ]),
+    (5, '포인트 원장 롤업 / 스냅샷', [
+        '''
+        CREATE TABLE IF NOT EXISTS rewards_daily (
+            user_id VARCHAR(50) NOT NULL,
+            day DATE NOT NULL,
+            amount BIGINT NOT NULL,
+            entries INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS rewards_history_archive (
+            id INTEGER PRIMARY KEY,
+            user_id VARCHAR(50) NOT NULL,
+            amount INTEGER NOT NULL,
+            reason VARCHAR(200),
+            created_at TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_rewards_archive_user ON rewards_history_archive (user_id, created_at, id)',
+        '''
+        CREATE TABLE IF NOT EXISTS rewards_balance_snapshots (
+            user_id VARCHAR(50) PRIMARY KEY,
+            balance BIGINT NOT NULL,
+            last_history_id INTEGER NOT NULL,
+            taken_at TIMESTAMP NOT NULL
+        )
+        ''',
+    ]),
+    (6, '작업자 대기열', [
+        '''
+        CREATE TABLE IF NOT EXISTS session_queue (
+            id SERIAL PRIMARY KEY,
+            user_id VARCHAR(50) UNIQUE NOT NULL,
+            enqueued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (7, '정리 작업 기록', [
+        '''
+        CREATE TABLE IF NOT EXISTS reaper_runs (
+            id SERIAL PRIMARY KEY,
+            ran_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sessions_expired INTEGER NOT NULL,
+            uids_released INTEGER NOT NULL,
+            leases_reclaimed INTEGER NOT NULL,
+            screenshots_pruned INTEGER NOT NULL,
+            details JSONB
+        )
+        ''',
+    ]),
+    (8, '토큰 폐기 목록', [
+        # 이 시각 이전에 발급된 토큰은 무효 (정지/삭제된 회원)
+        '''
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            user_id VARCHAR(50) PRIMARY KEY,
+            revoked_at TIMESTAMP NOT NULL
+        )
+        ''',
+    ]),
+    (9, '느린 쿼리 기록', [
+        '''
+        CREATE TABLE IF NOT EXISTS slow_queries (
+            id SERIAL PRIMARY KEY,
+            created_at TIMESTAMP NOT NULL,
+            route VARCHAR(200),
+            duration_ms DOUBLE PRECISION NOT NULL,
+            query TEXT NOT NULL,
+            params_shape JSONB,
+            plan JSONB
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_slow_queries_created_at ON slow_queries (created_at)',
+    ]),
+    (10, '키워드 리스', [
+        '''
+        ALTER TABLE keywords
+            ADD COLUMN IF NOT EXISTS lease_owner VARCHAR(50),
+            ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP
+        ''',
+        # 리스 없이 collecting 에 묶여 있던 키워드도 만료되면 회수되도록
+        '''
+        UPDATE keywords SET lease_expires_at = LOCALTIMESTAMP + INTERVAL '10 minutes'
+        WHERE status = 'collecting' AND lease_expires_at IS NULL
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_keywords_lease ON keywords (lease_expires_at) WHERE status = 'collecting'",
+    ]),
+    (11, '키워드 중복 확인 인덱스', [
+        # bulk_add_keywords 의 NOT EXISTS (기존 데이터에 중복이 있을 수 있어 UNIQUE 는 아님)
+        'CREATE INDEX IF NOT EXISTS idx_keywords_keyword ON keywords (keyword)',
+    ]),
+    (12, '목록 캐시 버전', [
+        # 버전은 트랜잭션과 무관한 시퀀스로 (버전 행 하나를 UPDATE 하면 keywords 를 바꾸는 모든 트랜잭션이
+        # 커밋까지 그 행 잠금을 잡아 리스/진행 기록/대량 등록이 서로 직렬화됨)
+        'CREATE SEQUENCE IF NOT EXISTS keywords_catalog_seq',
+        # 실제로 바뀐 행이 있는 문장마다 버전을 올리고 알림 (CatalogCache 무효화)
+        '''
+        CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+        DECLARE
+            changed BOOLEAN;
+        BEGIN
+            -- 트리거마다 있는 전이 테이블만 참조 (INSERT 는 new_rows, 나머지는 old_rows)
+            IF TG_OP = 'INSERT' THEN
+                changed := EXISTS (SELECT 1 FROM new_rows);
+            ELSE
+                changed := EXISTS (SELECT 1 FROM old_rows);
+            END IF;
+            IF changed THEN
+                PERFORM nextval((TG_ARGV[0] || '_catalog_seq')::regclass);
+                PERFORM pg_notify('catalog', TG_ARGV[0]);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        ''',
+        'DROP TRIGGER IF EXISTS keywords_catalog_insert ON keywords',
+        'DROP TRIGGER IF EXISTS keywords_catalog_update ON keywords',
+        'DROP TRIGGER IF EXISTS keywords_catalog_delete ON keywords',
+        '''
+        CREATE TRIGGER keywords_catalog_insert AFTER INSERT ON keywords
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version('keywords')
+        ''',
+        '''
+        CREATE TRIGGER keywords_catalog_update AFTER UPDATE ON keywords
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version('keywords')
+        ''',
+        '''
+        CREATE TRIGGER keywords_catalog_delete AFTER DELETE ON keywords
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version('keywords')
+        ''',
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+MIGRATION_LOCK_ID = 72100001  # pg_advisory_lock 키
+
+
+def get_schema_version(cur):
+    """현재 DB 에 적용된 스키마 버전 (schema_version 테이블이 없으면 0)"""
+    cur.execute("SELECT to_regclass('schema_version') AS t")
+    if cur.fetchone()['t'] is None:
+        return 0
+    cur.execute('SELECT COALESCE(MAX(version), 0) AS v FROM schema_version')
+    return cur.fetchone()['v']
+
+
+def migrate():
+    """적용 안 된 마이그레이션을 순서대로 실행 (advisory lock 으로 한 프로세스만, 나머지는 대기)"""
+    with psycopg.connect(DATABASE_URL, row_factory=dict_row) as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT pg_advisory_lock(%s)', (MIGRATION_LOCK_ID,))
+        conn.commit()
+        try:
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description VARCHAR(200),
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.commit()
+
+            current = get_schema_version(cur)
+            for version, description, statements in MIGRATIONS:
+                if version <= current:
+                    continue
+                for statement in statements:
+                    cur.execute(statement)
+                cur.execute('INSERT INTO schema_version (version, description) VALUES (%s, %s)',
+                           (version, description))
+                conn.commit()
+                print(f"✅ 마이그레이션 {version} 적용: {description}")
+        finally:
+            conn.rollback()
+            cur.execute('SELECT pg_advisory_unlock(%s)', (MIGRATION_LOCK_ID,))
+            conn.commit()
+
+
+def init_db():
+    """워커 시작 시 스키마 버전만 확인하고, 뒤처진 경우에만 마이그레이션"""
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        current = get_schema_version(cur)
+    finally:
+        cur.close()
+        release_db(conn)
+
+    if current < SCHEMA_VERSION:
+        migrate()
     print("✅ DB 초기화 완료")
 
 
+_throttle_lock = threading.Lock()
+_throttle_last = {}
+
+
+def throttled(name, interval):
+    """프로세스 안에서 name 작업을 interval 초에 한 번만 허용"""
+    now = time.monotonic()
+    with _throttle_lock:
+        if now - _throttle_last.get(name, float('-inf')) < interval:
+            return False
+        _throttle_last[name] = now
+        return True
+
+
+INT4_MAX = 2147483647  # INTEGER 컬럼 최댓값
+
+
+def int4_arg(value):
+    """요청으로 받은 값 → INTEGER 컬럼에 넣을 수 있는 int (숫자 문자열 허용), 아니면 None"""
+    if isinstance(value, str):
+        try:
+            value = int(value)
+        except ValueError:
+            return None
+    if not isinstance(value, int) or isinstance(value, bool) or not -INT4_MAX - 1 <= value <= INT4_MAX:
+        return None
+    return value
+
+
+class TTLCache:
+    """프로세스 안에서만 쓰는 간단한 TTL 캐시"""
+
+    def __init__(self, ttl, maxsize=256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data = {}  # key -> (만료 시각, 값)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._data) >= self.maxsize:
+                self._data.clear()
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class WriteBehindBuffer:
+    """키별 마지막 값만 모아 두었다가 interval 초마다 flush_fn(cur, items) 한 번으로 DB 에 기록"""
+
+    def __init__(self, name, flush_fn, interval):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._thread = None
+        self._pid = None
+        atexit.register(self.flush)
+
+    def put(self, key, value):
+        with self._lock:
+            self._pending[key] = value
+            if self._thread is None or self._pid != os.getpid():
+                self._pending = {key: value}  # fork 전에 쌓인 값은 부모 프로세스 몫
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def discard(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def flush(self):
+        with self._lock:
+            items, self._pending = self._pending, {}
+        if not items or not DATABASE_URL:
+            return
+        conn = get_db()
+        cur = conn.cursor()
+        try:
+            try:
+                self.flush_fn(cur, items)
+                conn.commit()
+            except psycopg.DataError as e:
+                # 잘못된 값 하나 때문에 매번 전체가 실패하지 않도록 한 건씩 다시 기록하고 실패한 건은 버림
+                print(f"{self.name} 기록 오류 (한 건씩 재시도): {e}")
+                conn.rollback()
+                self._flush_each(conn, cur, items)
+        except Exception as e:
+            print(f"{self.name} 기록 오류: {e}")
+            conn.rollback()
+            with self._lock:
+                for key, value in items.items():
+                    self._pending.setdefault(key, value)  # 그 사이 들어온 최신 값 우선
+        finally:
+            cur.close()
+            release_db(conn)
+
+    def _flush_each(self, conn, cur, items):
+        """기록했거나 버린 항목은 items 에서 빼 둠 (도중에 다른 오류가 나면 남은 것만 다시 쌓임)"""
+        for key in list(items):
+            try:
+                self.flush_fn(cur, {key: items[key]})
+                conn.commit()
+            except psycopg.DataError as e:
+                conn.rollback()
+                print(f"{self.name} 기록 실패, 버림 ({key!r}): {e}")
+            del items[key]
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+# ==================== 느린 쿼리 기록 ====================
+# SLOW_QUERY_MS 를 넘은 쿼리를 호출한 라우트, 파라미터 형태(값은 남기지 않음)와 함께 slow_queries 에 기록.
+# 그중 SLOW_QUERY_EXPLAIN_RATE 비율은 백그라운드 스레드에서 EXPLAIN 을 떠서 함께 저장한다.
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 0))  # 0 이면 기록 안 함
+SLOW_QUERY_EXPLAIN_RATE = float(os.environ.get('SLOW_QUERY_EXPLAIN_RATE', 0))  # 0~1
+SLOW_QUERY_EXPLAIN_INTERVAL = int(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL', 300))  # 같은 쿼리는 이 시간에 한 번만 EXPLAIN (초)
+SLOW_QUERY_RETENTION_DAYS = int(os.environ.get('SLOW_QUERY_RETENTION_DAYS', 7))
+
+query_route = contextvars.ContextVar('query_route', default=None)  # Flask 요청 밖(asgi.py)에서 호출 라우트
+_TRACE_SKIP_RE = re.compile(r'^\s*(EXPLAIN\b|$)|\bslow_queries\b', re.IGNORECASE)  # '' 는 풀의 헬스 체크
+_SIDE_EFFECT_RE = re.compile(r'\bpg_\w+\s*\(|\bnextval\s*\(|\bFOR\s+UPDATE\b', re.IGNORECASE)
+_slow_query_seq = itertools.count()
+_explain_queue = queue.Queue(maxsize=100)
+_explainer_pid = None
+_explainer_lock = threading.Lock()
+
+
+def _value_shape(value):
+    if isinstance(value, (list, tuple)):
+        return f'{type(value).__name__}[{len(value)}]'
+    if isinstance(value, (str, bytes)):
+        return f'{type(value).__name__}({len(value)})'
+    if isinstance(value, Jsonb):
+        return 'jsonb'
+    return type(value).__name__
+
+
+def params_shape(params):
+    """파라미터 값 대신 타입/길이만 (개인정보가 로그에 남지 않도록)"""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: _value_shape(v) for k, v in params.items()}
+    return [_value_shape(v) for v in params]
+
+
+def current_route():
+    if has_request_context():
+        return f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"
+    return query_route.get() or threading.current_thread().name
+
+
+def flush_slow_queries(cur, items):
+    cur.executemany('''
+        INSERT INTO slow_queries (created_at, route, duration_ms, query, params_shape, plan)
+        VALUES (%(created_at)s, %(route)s, %(duration_ms)s, %(query)s, %(params_shape)s, %(plan)s)
+    ''', list(items.values()))
+
+
+slow_queries = WriteBehindBuffer('slow_queries', flush_slow_queries, 5)
+
+
+def trace_query(cursor, query, params, elapsed):
+    """TimedCursor 에서 호출 - 느린 쿼리면 기록 (샘플링해서 EXPLAIN)"""
+    if not SLOW_QUERY_MS or elapsed * 1000 < SLOW_QUERY_MS:
+        return
+    if not isinstance(query, str):
+        query = query.as_string(cursor.connection)
+    if _TRACE_SKIP_RE.search(query):
+        return
+    
+    record = {
+        'created_at': datetime.now(),
+        'route': current_route(),
+        'duration_ms': round(elapsed * 1000, 2),
+        'query': query.strip(),
+        'params_shape': Jsonb(params_shape(params)),
+        'plan': None,
+    }
+    print(f"🐢 느린 쿼리 {record['duration_ms']}ms [{record['route']}] {' '.join(query.split())[:200]}")
+    
+    fingerprint = hashlib.sha1(query.encode()).hexdigest()
+    if (SLOW_QUERY_EXPLAIN_RATE and random.random() < SLOW_QUERY_EXPLAIN_RATE
+            and throttled(f'explain:{fingerprint}', SLOW_QUERY_EXPLAIN_INTERVAL)):
+        start_explainer()
+        try:
+            _explain_queue.put_nowait((record, params))
+            return
+        except queue.Full:
+            pass
+    slow_queries.put(next(_slow_query_seq), record)
+
+
+def explain(query, params):
+    """실행 계획 (JSON). 부작용 없는 SELECT 만 ANALYZE, 나머지는 계획만"""
+    analyze = query_labels(query)[0] == 'SELECT' and not _SIDE_EFFECT_RE.search(query)
+    options = 'ANALYZE, BUFFERS, FORMAT JSON' if analyze else 'FORMAT JSON'
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        cur.execute(f'EXPLAIN ({options}) {query}', params)
+        return cur.fetchone()['QUERY PLAN']
+    finally:
+        conn.rollback()
+        cur.close()
+        release_db(conn)
+
+
+def _explain_loop():
+    while True:
+        record, params = _explain_queue.get()
+        try:
+            record['plan'] = Jsonb(explain(record['query'], params))
+        except Exception as e:
+            record['plan'] = Jsonb({'error': str(e)})
+        slow_queries.put(next(_slow_query_seq), record)
+
+
+def start_explainer():
+    """워커 프로세스마다 EXPLAIN 스레드 하나 (요청 처리와 별도 커넥션)"""
+    global _explainer_pid
+    if _explainer_pid == os.getpid():
+        return
+    with _explainer_lock:
+        if _explainer_pid != os.getpid():
+            threading.Thread(target=_explain_loop, name='explainer', daemon=True).start()
+            _explainer_pid = os.getpid()
+
+
+def encode_cursor(created_at, row_id):
+    """(created_at, id) 키셋 커서 → URL 에 넣을 수 있는 문자열"""
+    raw = json.dumps([created_at.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """encode_cursor 의 역변환, 형식이 잘못되면 None"""
+    if not cursor:
+        return None
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+
+# ==================== 응답 압축 ====================
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))  # 이보다 작은 응답은 그대로 (바이트)
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))  # 높이면 CPU 비용이 크게 늘어남
+# 이미지 등 이미 압축된 형식은 제외
+COMPRESS_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/csv', 'text/plain', 'text/html'}
+
+
+def choose_encoding(accept_encoding):
+    """Accept-Encoding → 'br' / 'gzip' / None"""
+    if not accept_encoding:
+        return None
+    return parse_accept_header(accept_encoding).best_match(['br', 'gzip'] if brotli else ['gzip'])
+
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL)
+
+
+def compress_stream(chunks, encoding):
+    """스트리밍 응답을 조각 단위로 압축 (조각마다 flush 해서 받는 쪽이 바로 풀 수 있게)"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        process, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip 헤더
+        process, finish = compressor.compress, compressor.flush
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        out = process(chunk) + flush()
+        if out:
+            yield out
+    yield finish()
+
+
+@app.after_request
+def compress_response(response):
+    """Accept-Encoding 에 따라 gzip/brotli 압축 (스트리밍 응답 포함)"""
+    if (response.status_code < 200 or response.status_code in (204, 304) or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+    
+    if response.is_streamed:
+        chunks = response.response
+        response.response = compress_stream(chunks, encoding)
+        response.headers.pop('Content-Length', None)
+        if hasattr(chunks, 'close'):
+            # 감싼 제너레이터는 시작 전에 닫히면 finally 가 실행되지 않으므로 (HEAD 등)
+            # 원래 본문은 response.close() 에서 직접 닫아 정리 코드(커서 반납)가 실행되게 함
+            response.call_on_close(chunks.close)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress_body(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+# ==================== 실시간 알림 (LISTEN/NOTIFY) ====================
+LONGPOLL_MAX_WAIT = float(os.environ.get('LONGPOLL_MAX_WAIT', 25))  # 롱폴링 최대 대기 (초)
+
+
+def notify(cur, channel, payload):
+    """트랜잭션 커밋 시 전달되는 NOTIFY 발행"""
+    cur.execute('SELECT pg_notify(%s, %s)', (channel, payload))
+
+
+class Notifier:
+    """LISTEN 전용 커넥션 하나로 받은 NOTIFY를 대기 중인 요청 스레드에 전달"""
+
+    def __init__(self, channels):
+        self.channels = channels
+        self._cond = threading.Condition()
+        self._ready = threading.Event()
+        self._seq = {}  # (channel, payload) -> 수신 횟수
+        self._epoch = 0  # 재접속 횟수 (끊긴 동안 놓친 알림이 있을 수 있음)
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._ready.clear()
+            self._thread = threading.Thread(target=self._run, name='notifier', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+        self._ready.wait(2)
+
+    def _run(self):
+        while True:
+            try:
+                with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+                    for channel in self.channels:
+                        conn.execute(sql.SQL('LISTEN {}').format(sql.Identifier(channel)))
+                    with self._cond:
+                        self._epoch += 1
+                        self._cond.notify_all()
+                    self._ready.set()
+                    while True:
+                        for n in conn.notifies(timeout=30):
+                            self._dispatch((n.channel, n.payload))
+                        conn.execute('SELECT 1')  # 끊긴 커넥션 감지
+            except Exception as e:
+                print(f"notifier 오류: {e}")
+                self._ready.clear()
+                time.sleep(1)
+
+    def _dispatch(self, key):
+        with self._cond:
+            self._seq[key] = self._seq.get(key, 0) + 1
+            self._cond.notify_all()
+
+    def mark(self, key):
+        """wait()에 넘길 현재 위치 (DB 조회 전에 먼저 받아둘 것)"""
+        self.start()
+        with self._cond:
+            return (self._epoch, self._seq.get(key, 0))
+
+    def wait(self, key, mark, timeout):
+        """mark 이후 key 알림이 오거나 timeout까지 대기"""
+        if timeout <= 0:
+            return False
+        with self._cond:
+            return self._cond.wait_for(lambda: (self._epoch, self._seq.get(key, 0)) != mark, timeout)
+
+
+notifier = Notifier(['session_update', 'session_answer', 'session_slot', 'auth_revoke', 'catalog'])
+
+
+# ==================== 인증 토큰 ====================
+# 로그인 시 HMAC 서명 토큰을 발급하고, 세션/워커 API 는 DB 조회 없이 서명과 만료만 확인한다.
+# 정지된 회원은 revoked_tokens 에 기록하고 auth_revoke 알림으로 각 프로세스의 캐시를 갱신.
+AUTH_TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', 12 * 3600))  # 토큰 유효 시간 (초)
+AUTH_REQUIRED = os.environ.get('AUTH_REQUIRED', '0') == '1'  # 0 이면 토큰 없는 요청도 허용 (클라이언트 전환 기간)
+AUTH_SECRET = os.environ.get('AUTH_SECRET')
+if not AUTH_SECRET:
+    if AUTH_REQUIRED:
+        raise RuntimeError('AUTH_REQUIRED=1 이면 AUTH_SECRET 을 설정해야 합니다.')
+    # 배포(실행)마다 새 키 → 재시작하면 기존 토큰은 무효. 환경변수에 넣어 두면 fork 된 워커도 같은 키를 씀
+    AUTH_SECRET = os.environ['AUTH_SECRET'] = secrets.token_hex(32)
+    print("⚠️ AUTH_SECRET 이 설정되지 않아 임의의 서명 키를 생성했습니다 (재시작하면 발급된 토큰이 무효가 됨)")
+AUTH_REVOCATION_TTL = int(os.environ.get('AUTH_REVOCATION_TTL', 60))  # 알림을 놓쳐도 이 시간 안에는 폐기 목록 갱신 (초)
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _b64decode(s):
+    return base64.urlsafe_b64decode(s + '=' * (-len(s) % 4))
+
+
+def _sign(payload):
+    return _b64encode(hmac.new(AUTH_SECRET.encode(), payload.encode(), hashlib.sha256).digest())
+
+
+def issue_token(subject, role, approved=True):
+    """role 은 'user' (작업자, 자기 user_id 만) 또는 'bot' (워커/봇, 전체)"""
+    now = int(time.time())
+    claims = {'sub': subject, 'role': role, 'approved': approved, 'iat': now, 'exp': now + AUTH_TOKEN_TTL}
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+    return f'{payload}.{_sign(payload)}'
+
+
+def verify_token(token):
+    """서명과 만료 확인 → claims, 잘못된 토큰이면 None"""
+    payload, _, signature = token.partition('.')
+    if not hmac.compare_digest(signature.encode(), _sign(payload).encode()):  # str 은 ASCII 만 비교 가능
+        return None
+    try:
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, TypeError):
+        return None
+    if claims.get('exp', 0) < time.time():
+        return None
+    return claims
+
+
+class RevocationCache:
+    """revoked_tokens 를 프로세스에 캐시 (auth_revoke 알림이 오거나 ttl 이 지나면 다시 읽음)"""
+
+    key = ('auth_revoke', '')
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = None  # user_id -> 폐기 시각 (epoch 초)
+        self._loaded = 0
+        self._mark = None
+
+    def stale(self):
+        return (self._data is None or time.monotonic() - self._loaded > self.ttl
+                or notifier.mark(self.key) != self._mark)
+
+    def refresh(self):
+        mark = notifier.mark(self.key)  # 읽는 도중 온 알림을 놓치지 않도록 먼저
+        conn = get_db()
+        cur = conn.cursor()
+        try:
+            # 토큰 유효 시간보다 오래된 폐기는 볼 필요 없음
+            cur.execute('SELECT user_id, revoked_at FROM revoked_tokens WHERE revoked_at > %s',
+                        (datetime.now() - timedelta(seconds=AUTH_TOKEN_TTL),))
+            data = {r['user_id']: r['revoked_at'].timestamp() for r in cur.fetchall()}
+        finally:
+            cur.close()
+            release_db(conn)
+        with self._lock:
+            self._data, self._loaded, self._mark = data, time.monotonic(), mark
+
+    def revoked_at(self, user_id):
+        if self.stale():
+            self.refresh()
+        return self._data.get(user_id)
+
+
+revocations = RevocationCache(AUTH_REVOCATION_TTL)
+
+
+def revoke_tokens(cur, user_id):
+    """user_id 에게 지금까지 발급된 토큰 폐기"""
+    cur.execute('''
+        INSERT INTO revoked_tokens (user_id, revoked_at) VALUES (%s, %s)
+        ON CONFLICT (user_id) DO UPDATE SET revoked_at = EXCLUDED.revoked_at
+    ''', (user_id, datetime.now()))
+    notify(cur, 'auth_revoke', '')
+
+
+def bearer_token(header):
+    if header and header.startswith('Bearer '):
+        return header[7:].strip()
+    return None
+
+
+def check_auth(token, user_id, allow_user):
+    """토큰 검사 → 실패 시 (HTTP 상태, 메시지), 통과하면 None
+    
+    allow_user 면 'user' 토큰도 자기 user_id 에 한해 허용, 아니면 'bot' 토큰만.
+    """
+    if not token:
+        return (401, '인증 토큰이 필요합니다.') if AUTH_REQUIRED else None
+    claims = verify_token(token)
+    if claims is None:
+        # 전환 기간에는 재시작 등으로 서명 키가 바뀐 토큰도 토큰이 없는 요청처럼 허용
+        return (401, '토큰이 유효하지 않거나 만료되었습니다.') if AUTH_REQUIRED else None
+    if claims['role'] == 'bot':
+        return None
+    if not allow_user or claims['role'] != 'user' or claims['sub'] != user_id:
+        return 403, '권한이 없습니다.'
+    if not claims.get('approved'):
+        return 403, '관리자 승인 대기 중입니다.'
+    revoked = revocations.revoked_at(claims['sub'])
+    if revoked is not None and claims['iat'] <= revoked:
+        return 401, '정지된 계정입니다. 다시 로그인하세요.'
+    return None
+
+
+def auth_required(allow_user=False):
+    """Authorization: Bearer <토큰> 검사 (user_id 는 URL 또는 JSON 본문에서)"""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            user_id = kwargs.get('user_id')
+            if user_id is None and allow_user:
+                user_id = (request.get_json(silent=True) or {}).get('user_id')
+            error = check_auth(bearer_token(request.headers.get('Authorization')), user_id, allow_user)
+            if error:
+                status, message = error
+                return jsonify({'success': False, 'message': message}), status
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
 # ==================== 유저 API ====================
 
 @app.route('/api/register', methods=['POST'])
@@ -203,7 +1176,7 @@ def register():
         return jsonify({'success': False, 'message': f'회원가입 실패: {str(e)}'})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 @app.route('/api/check-userid', methods=['POST'])
@@ -227,7 +1200,7 @@ def check_userid():
         return jsonify({'available': True, 'message': '사용 가능한 아이디입니다.'})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 @app.route('/api/login', methods=['POST'])
@@ -263,11 +1236,13 @@ def login():
             'user_id': user_id, 
             'name': user.get('name', ''),
             'rewards': user['rewards'], 
-            'solved_count': user['solved_count']
+            'solved_count': user['solved_count'],
+            'token': issue_token(user_id, 'user', bool(user.get('is_approved', True))),
+            'expires_in': AUTH_TOKEN_TTL
         })
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 @app.route('/api/user/<user_id>')
@@ -282,54 +1257,108 @@ def get_user(user_id):
         return jsonify({'success': False})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 # ==================== 작업 세션 API ====================
-MAX_WORKERS = 4  # 동시 작업자 제한
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 4))  # 동시 작업자 제한
+SESSION_ACTIVE_MINUTES = 5  # 이 시간 안에 활동한 세션만 슬롯을 차지
+SESSION_QUEUE_TTL = int(os.environ.get('SESSION_QUEUE_TTL', 60))  # 이 시간 동안 다시 요청 없으면 대기열에서 제외 (초)
+ADMISSION_LOCK_ID = 72100004  # 슬롯 배정을 한 번에 하나씩
+
+
+def admit_session(cur, user_id):
+    """빈 슬롯이 있고 대기열 앞사람이 없으면 세션 시작 → (True, 작업자 수),
+    아니면 대기열 등록 → (False, 대기 순번)"""
+    cur.execute('SELECT pg_advisory_xact_lock(%s)', (ADMISSION_LOCK_ID,))
+    now = datetime.now()
+    cur.execute('DELETE FROM session_queue WHERE last_seen < %s', (now - timedelta(seconds=SESSION_QUEUE_TTL),))
+    
+    # 현재 활성 세션 수 (자기 자신 제외)
+    cur.execute('''
+        SELECT COUNT(*) FILTER (WHERE user_id != %(user_id)s) AS others,
+               COUNT(*) FILTER (WHERE user_id = %(user_id)s) AS mine
+        FROM work_sessions WHERE last_activity > %(since)s
+    ''', {'user_id': user_id, 'since': now - timedelta(minutes=SESSION_ACTIVE_MINUTES)})
+    live = cur.fetchone()
+    
+    # 나보다 먼저 줄 선 사람 수
+    cur.execute('''
+        SELECT COUNT(*) AS ahead FROM session_queue
+        WHERE id < COALESCE((SELECT id FROM session_queue WHERE user_id = %s), 2147483647)
+    ''', (user_id,))
+    ahead = cur.fetchone()['ahead']
+    
+    if not live['mine'] and live['others'] + ahead >= MAX_WORKERS:
+        cur.execute('''
+            INSERT INTO session_queue (user_id, last_seen) VALUES (%s, %s)
+            ON CONFLICT (user_id) DO UPDATE SET last_seen = EXCLUDED.last_seen
+        ''', (user_id, now))
+        return False, ahead + 1
+    
+    # 세션 시작 시 이전 데이터 모두 클리어
+    cur.execute('''
+        INSERT INTO work_sessions (user_id, last_activity)
+        VALUES (%s, %s)
+        ON CONFLICT (user_id) DO UPDATE SET 
+            last_activity = %s, 
+            answer = NULL,
+            screenshot = NULL,
+            screenshot_hash = NULL,
+            current_uid_id = NULL,
+            message = NULL,
+            version = nextval('work_sessions_version_seq')
+    ''', (user_id, now, now))
+    cur.execute('DELETE FROM session_queue WHERE user_id = %s', (user_id,))
+    notify(cur, 'session_update', user_id)
+    return True, live['others'] + 1
+
 
 @app.route('/api/session/start', methods=['POST'])
+@auth_required(allow_user=True)
 def start_session():
-    """작업자가 작업 시작"""
+    """작업자가 작업 시작
+    
+    자리가 없으면 대기열 순번(queue_position)을 돌려준다. wait=초 를 주면
+    자리가 날 때까지 응답을 보류한다. 대기 중에는 SESSION_QUEUE_TTL 안에 다시 요청해야 순번이 유지된다.
+    """
     data = request.json
     user_id = data.get('user_id')
+    wait = min(float(data.get('wait', 0) or 0), LONGPOLL_MAX_WAIT)
+    deadline = time.monotonic() + wait
+    key = ('session_slot', '')
     
-    conn = get_db()
-    cur = conn.cursor()
-    try:
-        # 현재 활성 세션 수 체크 (자기 자신 제외)
-        cur.execute('SELECT COUNT(*) as cnt FROM work_sessions WHERE user_id != %s', (user_id,))
-        result = cur.fetchone()
-        current_count = result['cnt'] if result else 0
+    while True:
+        mark = notifier.mark(key) if wait > 0 else None
+        conn = get_db()
+        cur = conn.cursor()
+        try:
+            admitted, count = admit_session(cur, user_id)
+            conn.commit()
+        finally:
+            cur.close()
+            release_db(conn)
+        
+        if admitted:
+            return jsonify({'success': True, 'workers': count})
         
-        if current_count >= MAX_WORKERS:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
             return jsonify({
                 'success': False, 
                 'error': 'full', 
-                'message': f'작업자가 많아 진행할 수 없습니다. (현재 {current_count}명 작업 중)'
+                'queue_position': count,
+                'message': f'작업자가 많아 대기 중입니다. (대기 {count}번째)'
             })
         
-        # 세션 시작 시 이전 데이터 모두 클리어
-        cur.execute('''
-            INSERT INTO work_sessions (user_id, last_activity)
-            VALUES (%s, %s)
-            ON CONFLICT (user_id) DO UPDATE SET 
-                last_activity = %s, 
-                answer = NULL,
-                screenshot = NULL,
-                current_uid_id = NULL,
-                message = NULL
-        ''', (user_id, datetime.now(), datetime.now()))
-        conn.commit()
-        return jsonify({'success': True, 'workers': current_count + 1})
-    finally:
-        cur.close()
-        conn.close()
+        # 커넥션은 반납한 채로 자리가 날 때까지 대기
+        notifier.wait(key, mark, remaining)
 
 
 @app.route('/api/session/end', methods=['POST'])
+@auth_required(allow_user=True)
 def end_session():
-    """작업자가 작업 종료"""
+    """작업자가 작업 종료 (대기열에 있었으면 대기 취소)"""
     data = request.json
     user_id = data.get('user_id')
     
@@ -337,14 +1366,88 @@ def end_session():
     cur = conn.cursor()
     try:
         cur.execute('DELETE FROM work_sessions WHERE user_id = %s', (user_id,))
+        cur.execute('DELETE FROM session_queue WHERE user_id = %s', (user_id,))
+        notify(cur, 'session_update', user_id)
+        notify(cur, 'session_slot', '')
         conn.commit()
         return jsonify({'success': True})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
+
+
+HEARTBEAT_FLUSH_SECONDS = float(os.environ.get('HEARTBEAT_FLUSH_SECONDS', 5))
+
+
+def flush_heartbeats(cur, items):
+    """모아 둔 작업자 활동 시간을 한 문장으로 기록"""
+    cur.execute('''
+        UPDATE work_sessions w SET last_activity = v.ts
+        FROM unnest(%s::varchar[], %s::timestamp[]) AS v(user_id, ts)
+        WHERE w.user_id = v.user_id AND w.last_activity < v.ts
+    ''', (list(items.keys()), list(items.values())))
+
+
+# 폴링마다 UPDATE 하지 않고 워커 프로세스별로 모아서 HEARTBEAT_FLUSH_SECONDS 마다 기록
+heartbeats = WriteBehindBuffer('heartbeats', flush_heartbeats, HEARTBEAT_FLUSH_SECONDS)
+
+
+# 비동기 모드(asgi.py)와 함께 쓰는 세션 쿼리
+SUBMIT_ANSWER_SQL = 'UPDATE work_sessions SET answer = %s WHERE user_id = %s'
+POLL_SESSION_SQL = 'SELECT screenshot_hash, message, current_uid_id, version FROM work_sessions WHERE user_id = %s'
+SCREENSHOT_SQL = 'SELECT data, mime_type FROM screenshots WHERE hash = %s'
+
+
+def etag_version(tags):
+    """If-None-Match 로 받은 ETag("v<version>") 중 세션 version, 없으면 None"""
+    for tag in tags:
+        if tag.startswith('v') and tag[1:].isdigit():
+            return int(tag[1:])
+    return None
+
+
+def session_payload(session):
+    """poll_session 의 변경 있음 응답 본문"""
+    screenshot_hash = session['screenshot_hash']
+    return {
+        'success': True,
+        'changed': True,
+        'screenshot_hash': screenshot_hash,
+        'screenshot_url': f'/api/screenshots/{screenshot_hash}' if screenshot_hash else None,
+        'message': session['message'],
+        'uid_id': session['current_uid_id'],
+        'version': session['version']
+    }
+
+
+# 스크린샷은 API 도메인에서 그대로 내려주므로 이미지 형식만 허용 (text/html 등은 저장형 XSS)
+SCREENSHOT_MIME_TYPES = {'image/png', 'image/jpeg', 'image/webp', 'image/gif'}
+
+
+def screenshot_mime_type(data, declared=None):
+    """허용된 이미지 타입이면 declared 그대로, 아니면 내용으로 판별 (모르면 image/png)"""
+    declared = (declared or '').strip().lower()
+    if declared in SCREENSHOT_MIME_TYPES:
+        return declared
+    if data.startswith(b'\xff\xd8'):
+        return 'image/jpeg'
+    if data.startswith(b'RIFF') and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data.startswith(b'GIF8'):
+        return 'image/gif'
+    return 'image/png'
+
+
+def screenshot_data_url(shot):
+    """inline=1 용 data URL (스크린샷이 없으면 None)"""
+    if not shot:
+        return None
+    data = bytes(shot['data'])
+    return f"data:{screenshot_mime_type(data, shot['mime_type'])};base64,{base64.b64encode(data).decode()}"
 
 
 @app.route('/api/session/submit-answer', methods=['POST'])
+@auth_required(allow_user=True)
 def submit_answer():
     """작업자가 답변 제출"""
     data = request.json
@@ -354,44 +1457,81 @@ def submit_answer():
     conn = get_db()
     cur = conn.cursor()
     try:
-        cur.execute('UPDATE work_sessions SET answer = %s, last_activity = %s WHERE user_id = %s',
-                   (answer, datetime.now(), user_id))
+        cur.execute(SUBMIT_ANSWER_SQL, (answer, user_id))
+        notify(cur, 'session_answer', user_id)
         conn.commit()
+        heartbeats.put(user_id, datetime.now())
         return jsonify({'success': True})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 @app.route('/api/session/poll/<user_id>')
+@auth_required(allow_user=True)
 def poll_session(user_id):
-    """작업자가 현재 상태 폴링"""
-    conn = get_db()
-    cur = conn.cursor()
-    try:
-        cur.execute('SELECT screenshot, message, current_uid_id FROM work_sessions WHERE user_id = %s', (user_id,))
-        session = cur.fetchone()
-        
-        if not session:
-            return jsonify({'success': False, 'message': '세션 없음'})
-        
-        # 활동 시간 갱신
-        cur.execute('UPDATE work_sessions SET last_activity = %s WHERE user_id = %s', (datetime.now(), user_id))
-        conn.commit()
+    """작업자가 현재 상태 폴링
+    
+    since=마지막으로 받은 version (또는 If-None-Match: ETag) 이 현재와 같으면
+    본문 없이 changed=False (헤더로 물었으면 304) 만 돌려준다.
+    wait=초 를 함께 주면 새 캡챠가 올라오거나 wait 초가 지날 때까지 응답을 보류한다 (롱폴링).
+    스크린샷은 screenshot_url 로 따로 받는다 (inline=1 이면 data URL 로 포함).
+    """
+    since = request.args.get('since', type=int)
+    if since is None:
+        since = etag_version(request.if_none_match.as_set())
+    inline = request.args.get('inline') == '1'
+    wait = min(request.args.get('wait', 0, type=float), LONGPOLL_MAX_WAIT)
+    deadline = time.monotonic() + wait
+    key = ('session_update', user_id)
+    
+    while True:
+        mark = notifier.mark(key) if wait > 0 else None
+        conn = get_db()
+        cur = conn.cursor()
+        try:
+            cur.execute(POLL_SESSION_SQL, (user_id,))
+            session = cur.fetchone()
+            
+            if not session:
+                return jsonify({'success': False, 'message': '세션 없음'})
+            
+            version = session['version']
+            remaining = deadline - time.monotonic()
+            if version == since and remaining <= 0:
+                # 변경 없음 - 활동 시간만 갱신하고 최소 응답
+                heartbeats.put(user_id, datetime.now())
+                if request.if_none_match:
+                    response = Response(status=304)
+                else:
+                    response = jsonify({'success': True, 'changed': False, 'version': version})
+                response.set_etag(f'v{version}')
+                return response
+            
+            if version != since:
+                # 활동 시간 갱신
+                heartbeats.put(user_id, datetime.now())
+                result = session_payload(session)
+                if inline:
+                    shot = None
+                    if session['screenshot_hash']:
+                        cur.execute(SCREENSHOT_SQL, (session['screenshot_hash'],))
+                        shot = cur.fetchone()
+                    result['screenshot'] = screenshot_data_url(shot)
+                response = jsonify(result)
+                response.set_etag(f'v{version}')
+                return response
+        finally:
+            cur.close()
+            release_db(conn)
         
-        return jsonify({
-            'success': True,
-            'screenshot': session['screenshot'],
-            'message': session['message'],
-            'uid_id': session['current_uid_id']
-        })
-    finally:
-        cur.close()
-        conn.close()
+        # 커넥션은 반납한 채로 update_screenshot 알림 대기
+        notifier.wait(key, mark, remaining)
 
 
 # ==================== Worker API ====================
 @app.route('/api/worker/active-sessions')
+@auth_required()
 def active_sessions():
     """Worker: 활성 세션 목록"""
     conn = get_db()
@@ -407,31 +1547,90 @@ def active_sessions():
         return jsonify({'success': True, 'sessions': [dict(s) for s in sessions]})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
+
+
+# 답변을 읽으면서 비우기 (동시에 확인해도 한 요청만 답변을 받음)
+# 서브쿼리에서 행을 잠그고 읽어야 잠금을 기다리는 동안 덮어쓴 새 답변을 돌려줌
+TAKE_ANSWER_SQL = '''
+    UPDATE work_sessions w SET answer = NULL
+    FROM (SELECT id, answer FROM work_sessions WHERE user_id = %s AND answer IS NOT NULL FOR UPDATE) old
+    WHERE w.id = old.id
+    RETURNING old.answer
+'''
 
 
 @app.route('/api/worker/check-answer/<user_id>')
+@auth_required()
 def check_answer(user_id):
-    """Worker: 답변 확인"""
-    conn = get_db()
-    cur = conn.cursor()
-    try:
-        cur.execute('SELECT answer FROM work_sessions WHERE user_id = %s AND answer IS NOT NULL', (user_id,))
-        row = cur.fetchone()
+    """Worker: 답변 확인 (wait=초 지정 시 답변이 올 때까지 대기)"""
+    wait = min(request.args.get('wait', 0, type=float), LONGPOLL_MAX_WAIT)
+    deadline = time.monotonic() + wait
+    key = ('session_answer', user_id)
+    
+    while True:
+        mark = notifier.mark(key) if wait > 0 else None
+        conn = get_db()
+        cur = conn.cursor()
+        try:
+            cur.execute(TAKE_ANSWER_SQL, (user_id,))
+            row = cur.fetchone()
+            conn.commit()
+        finally:
+            cur.close()
+            release_db(conn)
         
         if row:
-            # 답변 가져왔으면 비우기
-            cur.execute('UPDATE work_sessions SET answer = NULL WHERE user_id = %s', (user_id,))
-            conn.commit()
             return jsonify({'success': True, 'answer': row['answer']})
         
-        return jsonify({'success': True, 'answer': None})
-    finally:
-        cur.close()
-        conn.close()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return jsonify({'success': True, 'answer': None})
+        
+        # 커넥션은 반납한 채로 submit_answer 알림 대기
+        notifier.wait(key, mark, remaining)
+
+
+SCREENSHOT_RETENTION_MINUTES = int(os.environ.get('SCREENSHOT_RETENTION_MINUTES', 30))
+
+
+def decode_screenshot(screenshot):
+    """base64 (data URL 허용) → (바이트, mime 타입)
+    
+    data URL 의 타입은 SCREENSHOT_MIME_TYPES 일 때만 쓰고 나머지는 내용으로 판별.
+    """
+    declared = None
+    if screenshot.startswith('data:'):
+        header, _, screenshot = screenshot.partition(',')
+        declared = header[5:].split(';')[0]
+    data = base64.b64decode(''.join(screenshot.split()), validate=True)
+    return data, screenshot_mime_type(data, declared)
+
+
+# 같은 이미지를 다시 올리면 created_at 을 갱신해야 prune_screenshots 가 방금 다시 가리킨 이미지를 지우지 않음
+SAVE_SCREENSHOT_SQL = '''
+    INSERT INTO screenshots (hash, data, mime_type) VALUES (%s, %s, %s)
+    ON CONFLICT (hash) DO UPDATE SET created_at = LOCALTIMESTAMP
+'''
+UPDATE_SCREENSHOT_SQL = '''
+    UPDATE work_sessions 
+    SET screenshot = NULL, screenshot_hash = %s, current_uid_id = %s, message = %s, answer = NULL, version = nextval('work_sessions_version_seq')
+    WHERE user_id = %s
+'''
+
+
+def prune_screenshots(cur):
+    """어느 세션도 참조하지 않는 오래된 스크린샷 삭제"""
+    cur.execute('''
+        DELETE FROM screenshots s
+        WHERE s.created_at < %s
+          AND NOT EXISTS (SELECT 1 FROM work_sessions w WHERE w.screenshot_hash = s.hash)
+    ''', (datetime.now() - timedelta(minutes=SCREENSHOT_RETENTION_MINUTES),))
+    return cur.rowcount
 
 
 @app.route('/api/worker/update-screenshot', methods=['POST'])
+@auth_required()
 def update_screenshot():
     """Worker: 스크린샷 업데이트"""
     data = request.json
@@ -440,22 +1639,54 @@ def update_screenshot():
     uid_id = data.get('uid_id')
     message = data.get('message', '')
     
+    screenshot_hash = None
+    if screenshot:
+        try:
+            image, mime_type = decode_screenshot(screenshot)
+        except (binascii.Error, ValueError):
+            return jsonify({'success': False, 'message': '스크린샷 base64 형식 오류'})
+        screenshot_hash = hashlib.sha256(image).hexdigest()
+    
     conn = get_db()
     cur = conn.cursor()
     try:
-        cur.execute('''
-            UPDATE work_sessions 
-            SET screenshot = %s, current_uid_id = %s, message = %s, answer = NULL
-            WHERE user_id = %s
-        ''', (screenshot, uid_id, message, user_id))
+        if screenshot_hash:
+            cur.execute(SAVE_SCREENSHOT_SQL, (screenshot_hash, image, mime_type))
+        cur.execute(UPDATE_SCREENSHOT_SQL, (screenshot_hash, uid_id, message, user_id))
+        notify(cur, 'session_update', user_id)
         conn.commit()
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'screenshot_hash': screenshot_hash})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
+
+
+@app.route('/api/screenshots/<screenshot_hash>')
+def get_screenshot(screenshot_hash):
+    """스크린샷 이미지 (내용 해시 주소라 영구 캐시 가능)"""
+    if request.if_none_match.contains(screenshot_hash):
+        response = Response(status=304)
+    else:
+        conn = get_db()
+        cur = conn.cursor()
+        try:
+            cur.execute(SCREENSHOT_SQL, (screenshot_hash,))
+            shot = cur.fetchone()
+        finally:
+            cur.close()
+            release_db(conn)
+        if not shot:
+            return jsonify({'success': False, 'message': '스크린샷 없음'}), 404
+        data = bytes(shot['data'])
+        response = Response(data, mimetype=screenshot_mime_type(data, shot['mime_type']))  # 예전에 저장된 행도 다시 검사
+    response.set_etag(screenshot_hash)
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
 
 @app.route('/api/worker/session-timeout', methods=['POST'])
+@auth_required()
 def session_timeout():
     """Worker: 세션 타임아웃"""
     data = request.json
@@ -464,115 +1695,377 @@ def session_timeout():
     conn = get_db()
     cur = conn.cursor()
     try:
-        cur.execute('UPDATE work_sessions SET message = %s WHERE user_id = %s',
+        cur.execute("UPDATE work_sessions SET message = %s, version = nextval('work_sessions_version_seq') WHERE user_id = %s",
                    ('5분간 응답 없어 작업 종료됨', user_id))
+        notify(cur, 'session_update', user_id)
         conn.commit()
         return jsonify({'success': True})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 # ==================== UID API ====================
+UID_INSERT_BATCH = 5000  # INSERT 한 번에 넣는 UID 수
+UID_FIELD_LIMITS = (('uid', 100), ('store_name', 200), ('store_url', 500), ('keyword', 100))
+
+
+def parse_uid_item(item):
+    """add_uids 입력 1건 검증 → (uid, store_name, store_url, keyword), 잘못된 입력이면 None"""
+    if isinstance(item, str):
+        item = {'uid': item}
+    if not isinstance(item, dict):
+        return None
+    row = []
+    for field, limit in UID_FIELD_LIMITS:
+        value = item.get(field)
+        if isinstance(value, int) and not isinstance(value, bool):
+            value = str(value)  # 숫자 UID/스토어 값도 예전처럼 문자열로 저장
+        if value is not None and (not isinstance(value, str) or len(value) > limit):
+            return None
+        row.append(value)
+    if not row[0]:
+        return None
+    return tuple(row)
+
+
+def iter_ndjson_lines(stream):
+    """NDJSON 을 한 줄씩 읽음 (잘못된 줄은 None)"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def uid_items():
+    """요청 본문의 UID 목록 (NDJSON 이면 스트리밍), 본문이 {uids: [...]} 형식이 아니면 None"""
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return iter_ndjson_lines(request.stream)
+    data = request.json
+    if not isinstance(data, dict) or not isinstance(data.get('uids', []), list):
+        return None  # 문자열이면 글자마다 UID 로 들어가므로 목록만 허용
+    return data.get('uids', [])
+
+
+def insert_uid_batch(cur, rows):
+    """UID 묶음을 한 문장으로 INSERT, 새로 들어간 수 반환"""
+    cur.execute('''
+        INSERT INTO uid_queue (uid, store_name, store_url, keyword)
+        SELECT uid, store_name, store_url, keyword
+        FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[])
+            WITH ORDINALITY AS t(uid, store_name, store_url, keyword, ord)
+        ORDER BY ord
+        ON CONFLICT (uid) DO NOTHING
+    ''', [list(column) for column in zip(*rows)])
+    return cur.rowcount
+
+
 @app.route('/api/worker/add-uids', methods=['POST'])
+@auth_required()
 def add_uids():
-    """UID 추가"""
-    data = request.json
-    uids = data.get('uids', [])
+    """UID 추가 (JSON {uids: [...]} 또는 application/x-ndjson 한 줄에 1건)"""
+    items = uid_items()
+    if items is None:
+        return jsonify({'success': False, 'message': '본문은 {"uids": [...]} 형식이어야 합니다.'}), 400
     
     conn = get_db()
     cur = conn.cursor()
     try:
-        added = 0
-        for u in uids:
-            try:
-                cur.execute('''
-                    INSERT INTO uid_queue (uid, store_name, store_url, keyword)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT (uid) DO NOTHING
-                ''', (u['uid'], u.get('store_name'), u.get('store_url'), u.get('keyword')))
-                added += cur.rowcount
-            except:
-                pass
-        conn.commit()
-        return jsonify({'success': True, 'added': added})
+        added = duplicates = rejected = 0
+        batch = []
+        for item in items:
+            row = parse_uid_item(item)
+            if row is None:
+                rejected += 1
+                continue
+            batch.append(row)
+            if len(batch) >= UID_INSERT_BATCH:
+                inserted = insert_uid_batch(cur, batch)
+                conn.commit()
+                added += inserted
+                duplicates += len(batch) - inserted
+                batch = []
+        if batch:
+            inserted = insert_uid_batch(cur, batch)
+            conn.commit()
+            added += inserted
+            duplicates += len(batch) - inserted
+        return jsonify({'success': True, 'added': added, 'duplicates': duplicates, 'rejected': rejected})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
+
+
+UID_LEASE_SECONDS = int(os.environ.get('UID_LEASE_SECONDS', 300))  # UID 리스 기본 유효 시간
+UID_LEASE_MAX_SECONDS = int(os.environ.get('UID_LEASE_MAX_SECONDS', 3600))
+UID_LEASE_MAX_BATCH = int(os.environ.get('UID_LEASE_MAX_BATCH', 50))
+
+
+def clamped_int_arg(value, default, maximum):
+    """요청으로 받은 개수/리스 시간을 1 ~ maximum 으로 보정 (없거나 잘못된 값이면 default)"""
+    try:
+        n = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        n = default
+    return max(1, min(n, maximum))
+
+
+def reclaim_expired_uids(cur):
+    """리스가 만료된 processing UID 를 pending 으로 되돌림"""
+    cur.execute('''
+        UPDATE uid_queue SET status = 'pending', lease_owner = NULL, lease_expires_at = NULL
+        WHERE status = 'processing' AND lease_expires_at < %s
+    ''', (datetime.now(),))
+    return cur.rowcount
+
+
+def lease_uids(cur, owner, count, lease_seconds):
+    """pending UID 를 count 개까지 processing 으로 가져오면서 리스 기록"""
+    if throttled('reclaim_expired_uids', 30):
+        reclaim_expired_uids(cur)
+    cur.execute('''
+        UPDATE uid_queue SET status = 'processing', lease_owner = %s, lease_expires_at = %s
+        WHERE id IN (
+            SELECT id FROM uid_queue WHERE status = 'pending'
+            ORDER BY created_at, id LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING *
+    ''', (owner, datetime.now() + timedelta(seconds=lease_seconds), count))
+    return sorted(cur.fetchall(), key=lambda u: (u['created_at'], u['id']))
 
 
 @app.route('/api/worker/get-pending-uid')
+@auth_required()
 def get_pending_uid():
-    """대기 중인 UID 가져오기"""
+    """대기 중인 UID 가져오기 (owner 지정 가능, 리스 만료 시 자동 회수)"""
+    owner = request.args.get('owner')
+    lease_seconds = clamped_int_arg(request.args.get('lease_seconds'), UID_LEASE_SECONDS, UID_LEASE_MAX_SECONDS)
+    
     conn = get_db()
     cur = conn.cursor()
     try:
-        cur.execute('''
-            UPDATE uid_queue SET status = 'processing'
-            WHERE id = (
-                SELECT id FROM uid_queue WHERE status = 'pending'
-                ORDER BY created_at LIMIT 1
-                FOR UPDATE SKIP LOCKED
-            )
-            RETURNING *
-        ''')
-        uid = cur.fetchone()
+        uids = lease_uids(cur, owner, 1, lease_seconds)
         conn.commit()
         
-        if uid:
-            return jsonify({'success': True, 'uid': dict(uid)})
+        if uids:
+            return jsonify({'success': True, 'uid': dict(uids[0])})
         return jsonify({'success': False, 'message': '대기 중인 UID 없음'})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
+
+
+@app.route('/api/worker/lease-uids', methods=['POST'])
+@auth_required()
+def lease_uids_batch():
+    """UID 여러 개를 한 번에 리스"""
+    data = request.json
+    owner = data.get('owner')
+    count = clamped_int_arg(data.get('count'), 1, UID_LEASE_MAX_BATCH)
+    lease_seconds = clamped_int_arg(data.get('lease_seconds'), UID_LEASE_SECONDS, UID_LEASE_MAX_SECONDS)
+    
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        uids = lease_uids(cur, owner, count, lease_seconds)
+        conn.commit()
+        return jsonify({'success': True, 'uids': [dict(u) for u in uids]})
+    finally:
+        cur.close()
+        release_db(conn)
+
+
+@app.route('/api/worker/extend-lease', methods=['POST'])
+@auth_required()
+def extend_uid_lease():
+    """리스 연장 (자기 리스이고 아직 processing 인 UID 만)"""
+    data = request.json
+    owner = data.get('owner')
+    uid_ids = data.get('uid_ids', [])
+    lease_seconds = clamped_int_arg(data.get('lease_seconds'), UID_LEASE_SECONDS, UID_LEASE_MAX_SECONDS)
+    
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        cur.execute('''
+            UPDATE uid_queue SET lease_expires_at = %s
+            WHERE id = ANY(%s) AND status = 'processing' AND lease_owner IS NOT DISTINCT FROM %s
+            RETURNING id, lease_expires_at
+        ''', (datetime.now() + timedelta(seconds=lease_seconds), uid_ids, owner))
+        extended = cur.fetchall()
+        conn.commit()
+        return jsonify({'success': True, 'extended': [dict(u) for u in extended]})
+    finally:
+        cur.close()
+        release_db(conn)
+
+
+# UID 완료를 한 문장으로 처리 (results 저장, uid_queue 완료, 포인트 지급, 지급 내역)
+# processing 상태인 UID 만 완료되므로 같은 요청을 다시 보내도 포인트가 두 번 지급되지 않음
+COMPLETE_UIDS_SQL = '''
+    WITH items AS (
+        SELECT * FROM jsonb_to_recordset(%(items)s) AS x(
+            uid_id INTEGER, user_id VARCHAR(50), store_name VARCHAR(200), seller_name VARCHAR(200),
+            business_number VARCHAR(50), representative VARCHAR(100), phone VARCHAR(50),
+            email VARCHAR(100), address TEXT, store_url VARCHAR(500))
+    ),
+    claimed AS (
+        UPDATE uid_queue q SET status = 'completed', lease_owner = NULL, lease_expires_at = NULL
+        -- 리스가 만료돼 pending 으로 돌아간 UID 도 완료 처리 (다른 owner 가 다시 리스한 경우만 제외)
+        WHERE q.id IN (SELECT uid_id FROM items) AND q.status IN ('pending', 'processing')
+          AND (%(owner)s::VARCHAR IS NULL OR q.lease_owner IS NULL OR q.lease_owner = %(owner)s::VARCHAR)
+        RETURNING q.id
+    ),
+    done AS (
+        SELECT DISTINCT ON (i.uid_id) i.uid_id, NULLIF(i.user_id, '') AS user_id, i.store_name, i.seller_name,
+               i.business_number, i.representative, i.phone, i.email, i.address, i.store_url
+        FROM items i JOIN claimed c ON c.id = i.uid_id
+        ORDER BY i.uid_id
+    ),
+    saved AS (
+        -- task_id 없이 저장 (foreign key 문제 회피)
+        INSERT INTO results (store_name, seller_name, business_number,
+                             representative, phone, email, address, store_url, solved_by)
+        SELECT store_name, seller_name, business_number, representative, phone, email, address, store_url, user_id
+        FROM done
+    ),
+    solved AS (
+        SELECT user_id, COUNT(*) AS n FROM done WHERE user_id IS NOT NULL GROUP BY user_id
+    ),
+    rewarded AS (
+        -- 유저별 포인트 (기본값 10)
+        UPDATE users u SET rewards = u.rewards + s.n * COALESCE(NULLIF(u.point_per_solve, 0), 10),
+                           solved_count = u.solved_count + s.n
+        FROM solved s WHERE u.user_id = s.user_id
+        RETURNING u.user_id, COALESCE(NULLIF(u.point_per_solve, 0), 10) AS reward
+    ),
+    history AS (
+        INSERT INTO rewards_history (user_id, amount, reason)
+        SELECT d.user_id, r.reward, '캡챠 해결' FROM done d JOIN rewarded r ON r.user_id = d.user_id
+    )
+    SELECT d.uid_id, COALESCE(r.reward, 10) AS reward
+    FROM done d LEFT JOIN rewarded r ON r.user_id = d.user_id
+'''
+COMPLETE_UIDS_MAX_BATCH = 500
+
+
+# seller_info 필드 → results 컬럼 길이 (None 은 TEXT)
+COMPLETE_UID_FIELD_LIMITS = (('store_name', 200), ('seller_name', 200), ('business_number', 50),
+                             ('representative', 100), ('phone', 50), ('email', 100), ('address', None),
+                             ('store_url', 500))
+
+
+def _text_field(value, limit):
+    """문자열/숫자 → 문자열 (숫자는 예전처럼 문자열로 저장), 형식이 틀리거나 너무 길면 ValueError"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        value = str(value)
+    if value is not None and (not isinstance(value, str) or (limit and len(value) > limit)):
+        raise ValueError
+    return value
+
+
+def complete_uid_item(raw):
+    """완료 요청 1건 검증 → COMPLETE_UIDS_SQL 에 넘길 dict, 잘못된 입력이면 None
+    
+    한 건이라도 형식이 틀리면 문장 전체가 실패하므로 DB 에 넘기기 전에 걸러냄.
+    """
+    if not isinstance(raw, dict):
+        return None
+    uid_id = int4_arg(raw.get('uid_id'))
+    info = raw.get('seller_info')
+    if uid_id is None or not isinstance(info, (dict, type(None))):
+        return None
+    try:
+        item = {'uid_id': uid_id, 'user_id': _text_field(raw.get('user_id'), 50)}
+        for field, limit in COMPLETE_UID_FIELD_LIMITS:
+            item[field] = _text_field((info or {}).get(field), limit)
+    except ValueError:
+        return None
+    return item
+
+
+def complete_uids(cur, items, owner=None):
+    """UID 여러 건 완료 → {uid_id: 지급 포인트} (이미 완료됐거나 다른 owner 에게 리스된 UID 는 제외)"""
+    cur.execute(COMPLETE_UIDS_SQL, {'items': Jsonb(items), 'owner': owner})
+    return {row['uid_id']: row['reward'] for row in cur.fetchall()}
 
 
 @app.route('/api/worker/complete-uid', methods=['POST'])
+@auth_required()
 def complete_uid():
-    """UID 완료 + 결과 저장"""
+    """UID 완료 + 결과 저장 (중복 요청은 duplicate=True 로 무시)"""
     data = request.json
-    uid_id = data.get('uid_id')
-    user_id = data.get('user_id')
-    info = data.get('seller_info', {})
+    item = complete_uid_item(data)
+    if item is None or not isinstance(data.get('owner'), (str, type(None))):
+        return jsonify({'success': False, 'message': 'uid_id / user_id / seller_info / owner 형식 오류'}), 400
+    uid_id = item['uid_id']
     
     conn = get_db()
     cur = conn.cursor()
     try:
-        # task_id 없이 저장 (foreign key 문제 회피)
-        cur.execute('''
-            INSERT INTO results (store_name, seller_name, business_number,
-                               representative, phone, email, address, store_url, solved_by)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ''', (info.get('store_name'), info.get('seller_name'),
-              info.get('business_number'), info.get('representative'),
-              info.get('phone'), info.get('email'), info.get('address'),
-              info.get('store_url'), user_id))
-        
-        cur.execute('UPDATE uid_queue SET status = %s WHERE id = %s', ('completed', uid_id))
-        
-        # 유저별 포인트 조회 (기본값 10)
-        reward = 10
-        if user_id:
-            cur.execute('SELECT point_per_solve FROM users WHERE user_id = %s', (user_id,))
-            user_row = cur.fetchone()
-            if user_row and user_row.get('point_per_solve'):
-                reward = user_row['point_per_solve']
-            
-            cur.execute('UPDATE users SET rewards = rewards + %s, solved_count = solved_count + 1 WHERE user_id = %s', (reward, user_id))
-            cur.execute('INSERT INTO rewards_history (user_id, amount, reason) VALUES (%s, %s, %s)', (user_id, reward, '캡챠 해결'))
-        
+        completed = complete_uids(cur, [item], data.get('owner'))
         conn.commit()
-        return jsonify({'success': True, 'reward': reward})
+        if uid_id not in completed:
+            return jsonify({'success': True, 'reward': 0, 'duplicate': True})
+        return jsonify({'success': True, 'reward': completed[uid_id]})
     except Exception as e:
         print(f"complete_uid 오류: {e}")
         conn.rollback()
         return jsonify({'success': False, 'error': str(e)})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
+
+
+@app.route('/api/worker/complete-uids', methods=['POST'])
+@auth_required()
+def complete_uids_batch():
+    """UID 여러 건을 한 트랜잭션으로 완료
+    
+    {owner, items: [{uid_id, user_id, seller_info}, ...]}
+    형식이 잘못된 건은 rejected 로 돌려주고 나머지만 완료.
+    """
+    data = request.json
+    raw_items = data.get('items', [])
+    if not isinstance(raw_items, list) or not isinstance(data.get('owner'), (str, type(None))):
+        return jsonify({'success': False, 'message': 'items 는 목록, owner 는 문자열이어야 합니다.'}), 400
+    if len(raw_items) > COMPLETE_UIDS_MAX_BATCH:
+        return jsonify({'success': False, 'message': f'한 번에 최대 {COMPLETE_UIDS_MAX_BATCH}건'}), 400
+    items, rejected = [], []
+    for raw in raw_items:
+        item = complete_uid_item(raw)
+        if item is None:
+            rejected.append(raw.get('uid_id') if isinstance(raw, dict) else raw)
+        else:
+            items.append(item)
+    
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        completed = complete_uids(cur, items, data.get('owner')) if items else {}
+        conn.commit()
+        return jsonify({
+            'success': True,
+            'completed': [{'uid_id': k, 'reward': v} for k, v in completed.items()],
+            'duplicates': [i['uid_id'] for i in items if i['uid_id'] not in completed],
+            'rejected': rejected
+        })
+    except Exception as e:
+        print(f"complete_uids 오류: {e}")
+        conn.rollback()
+        return jsonify({'success': False, 'error': str(e)})
+    finally:
+        cur.close()
+        release_db(conn)
 
 
 @app.route('/api/worker/release-uid', methods=['POST'])
+@auth_required()
 def release_uid():
     """UID 반환"""
     data = request.json
@@ -581,62 +2074,204 @@ def release_uid():
     conn = get_db()
     cur = conn.cursor()
     try:
-        cur.execute('UPDATE uid_queue SET status = %s WHERE id = %s', ('pending', uid_id))
+        cur.execute('''
+            UPDATE uid_queue SET status = 'pending', lease_owner = NULL, lease_expires_at = NULL
+            WHERE id = %s
+        ''', (uid_id,))
         conn.commit()
         return jsonify({'success': True})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 # ==================== 키워드 API ====================
+KEYWORD_CATALOG_TTL = int(os.environ.get('KEYWORD_CATALOG_TTL', 60))  # 알림을 놓쳐도 이 시간마다 버전 확인 (초)
+
+
+class CatalogCache:
+    """<name>_catalog_seq 로 무효화되는 목록 캐시
+    
+    테이블이 바뀌면 트리거가 시퀀스를 올리고 catalog 알림을 보낸다. 알림이 없으면 DB 에 가지 않고,
+    ttl 이 지나면 시퀀스 값만 확인해서 그대로면 목록을 다시 읽지 않는다.
+    시퀀스 값은 커밋 전에도 보이므로 알림(커밋 후 도착)이 오면 값과 상관없이 다시 읽고,
+    ETag 는 버전이 아니라 내용 해시로 만든다.
+    """
+
+    def __init__(self, name, queries, ttl):
+        self.name = name
+        self.queries = queries  # variant -> SELECT
+        self.ttl = ttl
+        self.key = ('catalog', name)
+        # 새 시퀀스는 nextval 전후 모두 last_value 가 1 이므로 is_called 로 구분
+        self.version_sql = sql.SQL('SELECT CASE WHEN is_called THEN last_value ELSE 0 END AS version FROM {}').format(
+            sql.Identifier(f'{name}_catalog_seq'))
+        self._lock = threading.Lock()
+        self._version = None
+        self._data = {}  # variant -> (내용 해시, 행 목록)
+        self._checked = 0
+        self._mark = None
+
+    def get(self, variant):
+        """→ (내용 해시, 행 목록)"""
+        mark = notifier.mark(self.key)  # 읽는 도중 온 알림을 놓치지 않도록 먼저
+        with self._lock:
+            if mark != self._mark:
+                self._data = {}
+            elif time.monotonic() - self._checked < self.ttl and variant in self._data:
+                return self._data[variant]
+        
+        conn = get_db()
+        cur = conn.cursor()
+        try:
+            cur.execute(self.version_sql)
+            version = cur.fetchone()['version']
+            with self._lock:
+                if version != self._version:
+                    self._version, self._data = version, {}
+                entry = self._data.get(variant)
+            if entry is None:
+                cur.execute(self.queries[variant])
+                rows = [dict(r) for r in cur.fetchall()]
+                entry = (hashlib.sha256(app.json.dumps(rows).encode()).hexdigest()[:20], rows)
+        finally:
+            cur.close()
+            release_db(conn)
+        
+        with self._lock:
+            if version == self._version:
+                self._data[variant] = entry
+                self._mark, self._checked = mark, time.monotonic()
+        return entry
+
+
+keyword_catalog = CatalogCache('keywords', {
+    'active': 'SELECT * FROM keywords WHERE is_active = TRUE ORDER BY priority DESC',
+    'all': 'SELECT * FROM keywords ORDER BY priority DESC',
+}, KEYWORD_CATALOG_TTL)
+
+
+def catalog_response(etag, payload):
+    """If-None-Match 가 같으면 304, 아니면 JSON (클라이언트는 매번 재검증)"""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+
 @app.route('/api/keywords')
 def get_keywords():
-    conn = get_db()
-    cur = conn.cursor()
-    try:
-        cur.execute('SELECT * FROM keywords WHERE is_active = TRUE ORDER BY priority DESC')
-        return jsonify({'success': True, 'keywords': [dict(k) for k in cur.fetchall()]})
-    finally:
-        cur.close()
-        conn.close()
+    digest, keywords = keyword_catalog.get('active')
+    return catalog_response(f'k{digest}', {'success': True, 'keywords': keywords})
 
 
 # ==================== 어드민 API ====================
 @app.route('/api/admin/login', methods=['POST'])
 def admin_login():
     if request.json.get('password') == ADMIN_PASSWORD:
-        return jsonify({'success': True})
+        # 워커/봇도 이 토큰으로 세션·워커 API 호출
+        return jsonify({'success': True, 'token': issue_token('admin', 'bot'), 'expires_in': AUTH_TOKEN_TTL})
     return jsonify({'success': False})
 
 
-@app.route('/api/admin/stats')
-def admin_stats():
+DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', 10))  # 대시보드 집계 캐시 (초)
+DASHBOARD_LOCK_ID = 72100002  # 집계를 한 워커만 다시 계산하도록
+dashboard_local_cache = TTLCache(DASHBOARD_CACHE_TTL, maxsize=1)
+
+
+def compute_dashboard_stats(cur):
+    """대시보드 숫자를 한 문장으로 계산 (테이블 전체는 한 번씩만 훑음)"""
+    cur.execute('''
+        SELECT u.total_users, u.pending_users, r.total_results, t.today_results,
+               q.pending_uids, s.active_sessions
+        FROM (SELECT COUNT(*) AS total_users,
+                     COUNT(*) FILTER (WHERE is_approved = FALSE) AS pending_users
+              FROM users) u,
+             (SELECT COUNT(*) AS total_results FROM results) r,
+             -- 전체 건수와 따로 세야 idx_results_created_id 범위 스캔을 씀 (FILTER 는 전체 스캔 안에서 계산됨)
+             (SELECT COUNT(*) AS today_results FROM results WHERE created_at >= CURRENT_DATE) t,
+             (SELECT COUNT(*) AS pending_uids FROM uid_queue WHERE status = 'pending') q,
+             (SELECT COUNT(*) AS active_sessions FROM work_sessions WHERE last_activity > %s) s
+    ''', (datetime.now() - timedelta(minutes=5),))
+    return dict(cur.fetchone())
+
+
+def get_dashboard_stats():
+    """대시보드 집계 (프로세스 캐시 → 워커 공용 캐시 테이블 → 재계산 순)"""
+    cached = dashboard_local_cache.get('stats')
+    if cached:
+        return cached
+    
     conn = get_db()
     cur = conn.cursor()
     try:
-        stats = {}
-        cur.execute('SELECT COUNT(*) as c FROM users')
-        stats['total_users'] = cur.fetchone()['c']
-        cur.execute('SELECT COUNT(*) as c FROM users WHERE is_approved = FALSE')
-        stats['pending_users'] = cur.fetchone()['c']
-        cur.execute('SELECT COUNT(*) as c FROM results')
-        stats['total_results'] = cur.fetchone()['c']
-        cur.execute("SELECT COUNT(*) as c FROM uid_queue WHERE status = 'pending'")
-        stats['pending_uids'] = cur.fetchone()['c']
-        cur.execute("SELECT COUNT(*) as c FROM work_sessions WHERE last_activity > %s", (datetime.now() - timedelta(minutes=5),))
-        stats['active_sessions'] = cur.fetchone()['c']
-        cur.execute("SELECT COUNT(*) as c FROM results WHERE DATE(created_at) = CURRENT_DATE")
-        stats['today_results'] = cur.fetchone()['c']
-        return jsonify({'success': True, 'stats': stats})
+        cur.execute("SELECT data, computed_at FROM dashboard_cache WHERE name = 'stats'")
+        row = cur.fetchone()
+        fresh = row and row['computed_at'] > datetime.now() - timedelta(seconds=DASHBOARD_CACHE_TTL)
+        if not fresh:
+            # 다른 워커가 계산 중이면 이전 값을 그대로 사용
+            cur.execute('SELECT pg_try_advisory_xact_lock(%s) AS locked', (DASHBOARD_LOCK_ID,))
+            if cur.fetchone()['locked'] or not row:
+                stats = compute_dashboard_stats(cur)
+                computed_at = datetime.now()
+                cur.execute('''
+                    INSERT INTO dashboard_cache (name, data, computed_at) VALUES ('stats', %s, %s)
+                    ON CONFLICT (name) DO UPDATE SET data = EXCLUDED.data, computed_at = EXCLUDED.computed_at
+                ''', (Jsonb(stats), computed_at))
+                conn.commit()
+                row = {'data': stats, 'computed_at': computed_at}
+        cached = (row['data'], row['computed_at'])
+        dashboard_local_cache.set('stats', cached)
+        return cached
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
+
+
+@app.route('/api/admin/stats')
+def admin_stats():
+    stats, computed_at = get_dashboard_stats()
+    return jsonify({'success': True, 'stats': stats, 'computed_at': computed_at})
+
+
+RESULTS_PAGE_SIZE = 50
+RESULTS_COUNT_TTL = int(os.environ.get('RESULTS_COUNT_TTL', 30))  # count=cached 캐시 시간 (초)
+results_count_cache = TTLCache(RESULTS_COUNT_TTL)
+
+
+def count_results(cur, where, params, mode):
+    """필터가 적용된 결과 수 (exact: 정확, estimate: 플래너 추정치, cached: 정확한 값을 잠시 캐시)"""
+    where_sql = (' WHERE ' + ' AND '.join(where)) if where else ''
+    if mode == 'estimate':
+        cur.execute('EXPLAIN (FORMAT JSON) SELECT 1 FROM results' + where_sql, params)
+        plan = cur.fetchone()['QUERY PLAN']
+        return int(plan[0]['Plan']['Plan Rows'])
+    
+    key = (where_sql, tuple(params))
+    if mode == 'cached':
+        total = results_count_cache.get(key)
+        if total is not None:
+            return total
+    cur.execute('SELECT COUNT(*) as c FROM results' + where_sql, params)
+    total = cur.fetchone()['c']
+    results_count_cache.set(key, total)
+    return total
 
 
 @app.route('/api/admin/results')
 def admin_results():
-    page = int(request.args.get('page', 1))
+    """결과 목록 (created_at, id) 키셋 페이지네이션
+    
+    cursor=이전 응답의 next_cursor / prev_cursor, direction=next|prev.
+    count=exact|estimate|cached|none (기본 cached). page 는 예전 클라이언트용 OFFSET 방식.
+    """
+    page = request.args.get('page', 1, type=int)
+    cursor = decode_cursor(request.args.get('cursor'))
+    direction = request.args.get('direction', 'next')
+    count_mode = request.args.get('count', 'cached')
     used = request.args.get('used', '')
     search = request.args.get('search', '')
     
@@ -653,22 +2288,52 @@ def admin_results():
             where.append('(store_name ILIKE %s OR business_number ILIKE %s)')
             params.extend([f'%{search}%', f'%{search}%'])
         
-        sql = 'SELECT * FROM results'
-        if where:
-            sql += ' WHERE ' + ' AND '.join(where)
-        sql += ' ORDER BY created_at DESC LIMIT 50 OFFSET %s'
-        params.append((page-1)*50)
+        page_where = list(where)
+        page_params = list(params)
+        backward = cursor is not None and direction == 'prev'
+        if cursor:
+            page_where.append('(created_at, id) > (%s, %s)' if backward else '(created_at, id) < (%s, %s)')
+            page_params.extend(cursor)
         
-        cur.execute(sql, params)
+        query = 'SELECT * FROM results'
+        if page_where:
+            query += ' WHERE ' + ' AND '.join(page_where)
+        query += ' ORDER BY created_at ASC, id ASC' if backward else ' ORDER BY created_at DESC, id DESC'
+        query += ' LIMIT %s'
+        page_params.append(RESULTS_PAGE_SIZE + 1)
+        if not cursor and page > 1:
+            query += ' OFFSET %s'
+            page_params.append((page - 1) * RESULTS_PAGE_SIZE)
+        
+        cur.execute(query, page_params)
         results = cur.fetchall()
+        has_more = len(results) > RESULTS_PAGE_SIZE
+        results = results[:RESULTS_PAGE_SIZE]
+        if backward:
+            results.reverse()
+        
+        next_cursor = prev_cursor = None
+        if results:
+            first, last = results[0], results[-1]
+            if has_more or backward:
+                next_cursor = encode_cursor(last['created_at'], last['id'])
+            if (has_more if backward else (cursor is not None or page > 1)):
+                prev_cursor = encode_cursor(first['created_at'], first['id'])
         
-        cur.execute('SELECT COUNT(*) as c FROM results')
-        total = cur.fetchone()['c']
+        total = None
+        if count_mode in ('exact', 'estimate', 'cached'):
+            total = count_results(cur, where, params, count_mode)
         
-        return jsonify({'success': True, 'results': [dict(r) for r in results], 'total': total})
+        return jsonify({
+            'success': True,
+            'results': [dict(r) for r in results],
+            'total': total,
+            'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor
+        })
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 @app.route('/api/admin/results/<int:rid>/update', methods=['POST'])
@@ -685,7 +2350,7 @@ def update_result(rid):
         return jsonify({'success': True})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 @app.route('/api/admin/results/bulk-update', methods=['POST'])
@@ -699,19 +2364,116 @@ def bulk_update():
         return jsonify({'success': True})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
+
+
+EXPORT_FETCH_SIZE = 1000  # 서버 사이드 커서에서 한 번에 읽는 행 수
+
+
+def parse_date_arg(value, end=False):
+    """from/to 쿼리 파라미터 → datetime (날짜만 주면 to 는 그 날 끝까지 포함)"""
+    parsed = datetime.fromisoformat(value)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
 
 
 @app.route('/api/admin/results/export')
 def export_results():
+    """결과 내보내기 - 서버 사이드 커서로 나눠 읽으며 바로 응답에 씀
+    
+    format=json(기본, 예전 형식)|ndjson|csv, from/to=YYYY-MM-DD[THH:MM:SS],
+    used=true|false, solved_by=아이디
+    """
+    fmt = request.args.get('format', 'json')
+    if fmt not in ('json', 'ndjson', 'csv'):
+        return jsonify({'success': False, 'message': 'format 은 json, ndjson, csv 중 하나'}), 400
+    
+    where = []
+    params = []
+    try:
+        if request.args.get('from'):
+            where.append('created_at >= %s')
+            params.append(parse_date_arg(request.args['from']))
+        if request.args.get('to'):
+            where.append('created_at < %s')
+            params.append(parse_date_arg(request.args['to'], end=True))
+    except ValueError:
+        return jsonify({'success': False, 'message': '날짜 형식 오류 (YYYY-MM-DD)'}), 400
+    used = request.args.get('used', '')
+    if used == 'true':
+        where.append('used = TRUE')
+    elif used == 'false':
+        where.append('used = FALSE')
+    if request.args.get('solved_by'):
+        where.append('solved_by = %s')
+        params.append(request.args['solved_by'])
+    
+    query = 'SELECT * FROM results'
+    if where:
+        query += ' WHERE ' + ' AND '.join(where)
+    query += ' ORDER BY created_at DESC, id DESC'
+    
+    mimetype = {'json': 'application/json', 'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}[fmt]
+    headers = {} if fmt == 'json' else {'Content-Disposition': f'attachment; filename=results.{fmt}'}
+    if request.method == 'HEAD':
+        return Response(mimetype=mimetype, headers=headers)  # 본문을 읽지 않으므로 커서를 열 필요 없음
+    
     conn = get_db()
-    cur = conn.cursor()
     try:
-        cur.execute('SELECT * FROM results ORDER BY created_at DESC')
-        return jsonify({'success': True, 'results': [dict(r) for r in cur.fetchall()]})
-    finally:
-        cur.close()
-        conn.close()
+        cur = conn.cursor(name='export_results')
+        cur.execute(query, params)
+    except Exception:
+        release_db(conn)
+        raise
+    
+    closed = False
+    
+    def close():
+        """커서 닫고 커넥션 반납 (끝까지 읽었을 때와 response.close() 중 먼저 오는 쪽에서 한 번)"""
+        nonlocal closed
+        if not closed:
+            closed = True
+            cur.close()
+            release_db(conn)
+    
+    def generate():
+        try:
+            if fmt == 'json':
+                yield '{"success": true, "results": ['
+            elif fmt == 'csv':
+                columns = [c.name for c in cur.description]
+                buf = io.StringIO()
+                csv.writer(buf).writerow(columns)
+                yield '\ufeff' + buf.getvalue()  # 엑셀에서 한글이 깨지지 않도록 BOM
+            
+            first = True
+            while True:
+                rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+                if not rows:
+                    break
+                if fmt == 'json':
+                    chunk = ', '.join(app.json.dumps(r) for r in rows)
+                    yield chunk if first else ', ' + chunk
+                elif fmt == 'ndjson':
+                    yield ''.join(app.json.dumps(r) + '\n' for r in rows)
+                else:
+                    buf = io.StringIO()
+                    writer = csv.writer(buf)
+                    for r in rows:
+                        writer.writerow([r[c] for c in columns])
+                    yield buf.getvalue()
+                first = False
+            
+            if fmt == 'json':
+                yield ']}'
+        finally:
+            close()
+    
+    response = Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+    # 제너레이터가 한 번도 시작되지 않으면 finally 가 실행되지 않으므로 (본문을 읽기 전에 끊긴 경우 등)
+    response.call_on_close(close)
+    return response
 
 
 @app.route('/api/admin/users')
@@ -730,7 +2492,7 @@ def admin_users():
         return jsonify({'success': True, 'users': [dict(u) for u in cur.fetchall()]})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 @app.route('/api/admin/users/<user_id>/approve', methods=['POST'])
@@ -744,7 +2506,7 @@ def approve_user(user_id):
         return jsonify({'success': True, 'message': '회원 승인 완료'})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 @app.route('/api/admin/users/<user_id>/reject', methods=['POST'])
@@ -754,11 +2516,13 @@ def reject_user(user_id):
     cur = conn.cursor()
     try:
         cur.execute('DELETE FROM users WHERE user_id = %s AND is_approved = FALSE', (user_id,))
+        if cur.rowcount:
+            revoke_tokens(cur, user_id)
         conn.commit()
         return jsonify({'success': True, 'message': '회원 거절 (삭제) 완료'})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 @app.route('/api/admin/users/<user_id>/suspend', methods=['POST'])
@@ -768,11 +2532,12 @@ def suspend_user(user_id):
     cur = conn.cursor()
     try:
         cur.execute('UPDATE users SET is_approved = FALSE WHERE user_id = %s', (user_id,))
+        revoke_tokens(cur, user_id)
         conn.commit()
         return jsonify({'success': True, 'message': '회원 정지 완료'})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 @app.route('/api/admin/users/<user_id>/set-point', methods=['POST'])
@@ -789,7 +2554,7 @@ def set_user_point(user_id):
         return jsonify({'success': True, 'message': f'포인트 {point}원으로 설정됨'})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 @app.route('/api/admin/users/<user_id>/adjust-rewards', methods=['POST'])
@@ -805,7 +2570,13 @@ def adjust_rewards(user_id):
         return jsonify({'success': True})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
+
+
+@app.route('/api/admin/db-pool')
+def admin_db_pool():
+    """커넥션 풀 상태"""
+    return jsonify({'success': True, 'pool': get_pool().get_stats()})
 
 
 @app.route('/api/admin/withdrawals')
@@ -818,7 +2589,7 @@ def admin_withdrawals():
         return jsonify({'success': True, 'withdrawals': [dict(w) for w in cur.fetchall()]})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 @app.route('/api/admin/withdrawals/<int:wid>/process', methods=['POST'])
@@ -844,19 +2615,13 @@ def process_withdrawal(wid):
         return jsonify({'success': True})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 @app.route('/api/admin/keywords')
 def admin_keywords():
-    conn = get_db()
-    cur = conn.cursor()
-    try:
-        cur.execute('SELECT * FROM keywords ORDER BY priority DESC')
-        return jsonify({'success': True, 'keywords': [dict(k) for k in cur.fetchall()]})
-    finally:
-        cur.close()
-        conn.close()
+    digest, keywords = keyword_catalog.get('all')
+    return catalog_response(f'ka{digest}', {'success': True, 'keywords': keywords})
 
 
 @app.route('/api/admin/keywords', methods=['POST'])
@@ -871,7 +2636,7 @@ def add_keyword():
         return jsonify({'success': True, 'id': cur.fetchone()['id']})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 @app.route('/api/admin/keywords/<int:kid>', methods=['PUT'])
@@ -887,7 +2652,7 @@ def update_keyword(kid):
         return jsonify({'success': True})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 @app.route('/api/admin/keywords/<int:kid>', methods=['DELETE'])
@@ -900,105 +2665,205 @@ def delete_keyword(kid):
         return jsonify({'success': True})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
+
+
+KEYWORD_MAX_LENGTH = 100  # keywords.keyword VARCHAR(100)
+KEYWORD_IMPORT_LOCK_ID = 72100006  # 동시에 같은 키워드를 넣지 않도록 가져오기를 한 번에 하나씩
+
+# 입력 순서를 유지하면서 배치 안 중복과 기존 키워드를 빼고 한 문장으로 등록
+BULK_ADD_KEYWORDS_SQL = '''
+    WITH input AS (
+        SELECT DISTINCT ON (keyword) keyword, ord
+        FROM unnest(%(keywords)s::varchar[]) WITH ORDINALITY AS t(keyword, ord)
+        ORDER BY keyword, ord
+    )
+    INSERT INTO keywords (keyword, priority, max_count, status)
+    SELECT i.keyword, %(priority)s, %(max_count)s, 'pending'
+    FROM input i
+    WHERE NOT EXISTS (SELECT 1 FROM keywords k WHERE k.keyword = i.keyword)
+    ORDER BY i.ord
+'''
+
+
+def parse_keyword_lines(keywords):
+    """줄 단위 텍스트(또는 목록) → (정리된 키워드 목록, 형식 오류 수). 빈 줄은 무시"""
+    lines = keywords.split('\n') if isinstance(keywords, str) else keywords
+    valid, invalid = [], 0
+    for line in lines:
+        if not isinstance(line, str):
+            invalid += 1
+            continue
+        keyword = ' '.join(line.split())  # 앞뒤/중복 공백 정리
+        if not keyword:
+            continue
+        if len(keyword) > KEYWORD_MAX_LENGTH:
+            invalid += 1
+            continue
+        valid.append(keyword)
+    return valid, invalid
 
 
 @app.route('/api/admin/keywords/bulk', methods=['POST'])
 def bulk_add_keywords():
-    """키워드 대량 등록"""
-    data = request.json
-    keywords_text = data.get('keywords', '')
-    max_count = data.get('max_count', 100)
+    """키워드 대량 등록 (이미 있는 키워드와 목록 안 중복은 제외)
     
-    keywords = [k.strip() for k in keywords_text.split('\n') if k.strip()]
+    {keywords: "줄바꿈으로 구분" 또는 [...], max_count, priority}
+    """
+    data = request.json
+    try:
+        max_count = int(data.get('max_count', 100))
+        priority = int(data.get('priority', 0))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'max_count / priority 형식 오류'})
+    keywords, invalid = parse_keyword_lines(data.get('keywords') or '')
     
     conn = get_db()
     cur = conn.cursor()
     try:
         added = 0
-        for kw in keywords:
-            try:
-                cur.execute('''
-                    INSERT INTO keywords (keyword, max_count, status)
-                    VALUES (%s, %s, 'pending')
-                ''', (kw, max_count))
-                added += 1
-            except:
-                pass
+        if keywords:
+            cur.execute('SELECT pg_advisory_xact_lock(%s)', (KEYWORD_IMPORT_LOCK_ID,))
+            cur.execute(BULK_ADD_KEYWORDS_SQL, {'keywords': keywords, 'priority': priority, 'max_count': max_count})
+            added = cur.rowcount
         conn.commit()
-        return jsonify({'success': True, 'added': added})
+        return jsonify({'success': True, 'added': added, 'duplicates': len(keywords) - added, 'invalid': invalid})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 # ==================== Collector API ====================
+KEYWORD_LEASE_SECONDS = int(os.environ.get('KEYWORD_LEASE_SECONDS', 600))  # 키워드 리스 기본 유효 시간
+KEYWORD_LEASE_MAX_SECONDS = int(os.environ.get('KEYWORD_LEASE_MAX_SECONDS', 3600))
+KEYWORD_LEASE_MAX_BATCH = int(os.environ.get('KEYWORD_LEASE_MAX_BATCH', 20))
+KEYWORD_PROGRESS_FLUSH_SECONDS = float(os.environ.get('KEYWORD_PROGRESS_FLUSH_SECONDS', 5))
+
+
+def reclaim_expired_keywords(cur):
+    """리스가 만료된 collecting 키워드를 pending 으로 되돌림 (수집한 수는 유지)"""
+    cur.execute('''
+        UPDATE keywords SET status = 'pending', lease_owner = NULL, lease_expires_at = NULL
+        WHERE status = 'collecting' AND lease_expires_at < %s
+    ''', (datetime.now(),))
+    return cur.rowcount
+
+
+def lease_keywords(cur, owner, count, lease_seconds):
+    """pending 키워드를 우선순위 순으로 count 개까지 collecting 으로 가져오면서 리스 기록"""
+    if throttled('reclaim_expired_keywords', 30):
+        reclaim_expired_keywords(cur)
+    cur.execute('''
+        UPDATE keywords SET status = 'collecting', lease_owner = %s, lease_expires_at = %s
+        WHERE id IN (
+            SELECT id FROM keywords 
+            WHERE status = 'pending' AND is_active = TRUE
+            ORDER BY priority DESC, created_at ASC
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING *
+    ''', (owner, datetime.now() + timedelta(seconds=lease_seconds), count))
+    return sorted(cur.fetchall(), key=lambda k: (-k['priority'], k['created_at']))
+
+
+def flush_keyword_progress(cur, items):
+    """모아 둔 수집 진행 상황을 한 문장으로 기록 (진행 보고가 온 리스는 그 시점부터 연장)"""
+    cur.execute('''
+        UPDATE keywords k
+        SET collected_count = v.collected_count,
+            lease_expires_at = GREATEST(k.lease_expires_at, v.ts + make_interval(secs => v.lease_seconds))
+        FROM unnest(%s::int[], %s::int[], %s::varchar[], %s::timestamp[], %s::int[])
+            AS v(id, collected_count, owner, ts, lease_seconds)
+        WHERE k.id = v.id AND k.status = 'collecting'
+          AND (v.owner IS NULL OR k.lease_owner IS NOT DISTINCT FROM v.owner)
+    ''', [list(col) for col in zip(*((kid, *value) for kid, value in items.items()))])
+
+
+# 진행 보고마다 UPDATE 하지 않고 워커 프로세스별로 모아서 KEYWORD_PROGRESS_FLUSH_SECONDS 마다 기록
+keyword_progress = WriteBehindBuffer('keyword_progress', flush_keyword_progress, KEYWORD_PROGRESS_FLUSH_SECONDS)
+
+
 @app.route('/api/collector/pending-keyword')
 def get_pending_keyword():
-    """수집할 키워드 가져오기 (pending → collecting)"""
+    """수집할 키워드 가져오기 (pending → collecting, owner 지정 가능, 리스 만료 시 자동 회수)"""
+    owner = request.args.get('owner')
+    lease_seconds = clamped_int_arg(request.args.get('lease_seconds'), KEYWORD_LEASE_SECONDS, KEYWORD_LEASE_MAX_SECONDS)
+    
     conn = get_db()
     cur = conn.cursor()
     try:
-        cur.execute('''
-            UPDATE keywords SET status = 'collecting'
-            WHERE id = (
-                SELECT id FROM keywords 
-                WHERE status = 'pending' AND is_active = TRUE
-                ORDER BY priority DESC, created_at ASC
-                LIMIT 1
-                FOR UPDATE SKIP LOCKED
-            )
-            RETURNING *
-        ''')
-        keyword = cur.fetchone()
+        keywords = lease_keywords(cur, owner, 1, lease_seconds)
         conn.commit()
         
-        if keyword:
-            return jsonify({'success': True, 'keyword': dict(keyword)})
+        if keywords:
+            return jsonify({'success': True, 'keyword': dict(keywords[0])})
         return jsonify({'success': False, 'message': '대기 중인 키워드 없음'})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
-@app.route('/api/collector/update-progress', methods=['POST'])
-def update_keyword_progress():
-    """수집 진행 상황 업데이트"""
+@app.route('/api/collector/lease-keywords', methods=['POST'])
+def lease_keywords_batch():
+    """키워드 여러 개를 한 번에 리스"""
     data = request.json
-    keyword_id = data.get('keyword_id')
-    collected_count = data.get('collected_count', 0)
+    owner = data.get('owner')
+    count = clamped_int_arg(data.get('count'), 1, KEYWORD_LEASE_MAX_BATCH)
+    lease_seconds = clamped_int_arg(data.get('lease_seconds'), KEYWORD_LEASE_SECONDS, KEYWORD_LEASE_MAX_SECONDS)
     
     conn = get_db()
     cur = conn.cursor()
     try:
-        cur.execute('UPDATE keywords SET collected_count = %s WHERE id = %s',
-                   (collected_count, keyword_id))
+        keywords = lease_keywords(cur, owner, count, lease_seconds)
         conn.commit()
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'keywords': [dict(k) for k in keywords]})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
+
+
+@app.route('/api/collector/update-progress', methods=['POST'])
+def update_keyword_progress():
+    """수집 진행 상황 업데이트 (모아서 기록, 리스도 함께 연장)"""
+    data = request.json
+    # 모아서 한 문장으로 기록하므로 잘못된 값은 여기서 걸러야 다른 수집기의 기록까지 실패하지 않음
+    keyword_id = int4_arg(data.get('keyword_id'))
+    collected_count = int4_arg(data.get('collected_count', 0))
+    owner = data.get('owner')
+    if keyword_id is None or collected_count is None:
+        return jsonify({'success': False, 'message': 'keyword_id / collected_count 형식 오류'}), 400
+    if owner is not None and not isinstance(owner, str):
+        return jsonify({'success': False, 'message': 'owner 형식 오류'}), 400
+    lease_seconds = clamped_int_arg(data.get('lease_seconds'), KEYWORD_LEASE_SECONDS, KEYWORD_LEASE_MAX_SECONDS)
+    keyword_progress.put(keyword_id, (collected_count, owner, datetime.now(), lease_seconds))
+    return jsonify({'success': True})
 
 
 @app.route('/api/collector/complete-keyword', methods=['POST'])
 def complete_keyword():
-    """키워드 수집 완료"""
+    """키워드 수집 완료 (owner 를 주면 자기 리스인 경우만)"""
     data = request.json
     keyword_id = data.get('keyword_id')
     collected_count = data.get('collected_count', 0)
+    owner = data.get('owner')
     
     conn = get_db()
     cur = conn.cursor()
     try:
         cur.execute('''
-            UPDATE keywords SET status = 'completed', collected_count = %s
-            WHERE id = %s
-        ''', (collected_count, keyword_id))
+            UPDATE keywords SET status = 'completed', collected_count = %s, lease_owner = NULL, lease_expires_at = NULL
+            WHERE id = %s AND (%s::VARCHAR IS NULL OR lease_owner IS NOT DISTINCT FROM %s::VARCHAR)
+        ''', (collected_count, keyword_id, owner, owner))
+        completed = cur.rowcount
         conn.commit()
+        if not completed:
+            return jsonify({'success': False, 'message': '리스가 만료되었거나 다른 수집기의 키워드입니다.'})
+        keyword_progress.discard(keyword_id)  # 완료 후 늦게 기록되지 않도록
         return jsonify({'success': True})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 @app.route('/api/collector/reset-keyword/<int:kid>', methods=['POST'])
@@ -1008,14 +2873,15 @@ def reset_keyword(kid):
     cur = conn.cursor()
     try:
         cur.execute('''
-            UPDATE keywords SET status = 'pending', collected_count = 0
+            UPDATE keywords SET status = 'pending', collected_count = 0, lease_owner = NULL, lease_expires_at = NULL
             WHERE id = %s
         ''', (kid,))
         conn.commit()
+        keyword_progress.discard(kid)
         return jsonify({'success': True})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
 @app.route('/api/withdraw', methods=['POST'])
@@ -1043,29 +2909,433 @@ def withdraw():
         return jsonify({'success': True})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
 
 
-# ==================== 상태 ====================
-@app.route('/')
-def index():
-    return jsonify({'status': 'ok', 'message': '캡챠 API 서버 v2 polling'})
+# ==================== 포인트 원장 ====================
+# rewards_history 는 최근 내역만 두고, 오래된 행은 일별 합계(rewards_daily)로 묶은 뒤
+# rewards_history_archive 로 옮긴다. 잔액 스냅샷(last_history_id 까지의 합)과
+# 그 이후 내역만 더하면 users.rewards 와 원장을 싸게 대조할 수 있다.
+REWARDS_ROLLUP_DAYS = int(os.environ.get('REWARDS_ROLLUP_DAYS', 30))  # 이보다 오래된 내역을 롤업
+REWARDS_ROLLUP_INTERVAL = int(os.environ.get('REWARDS_ROLLUP_INTERVAL', 3600))  # reaper 가 롤업하는 주기 (초), 0 이면 안 함
+REWARDS_ROLLUP_LOCK_ID = 72100003
+REWARDS_HISTORY_PAGE_SIZE = 50
 
 
-@app.route('/api/status')
-def status():
+def rollup_rewards(cur, days=REWARDS_ROLLUP_DAYS):
+    """잔액 스냅샷 갱신 후 days 일 지난 내역을 일별 합계 + 아카이브로 이동"""
+    # 막 들어온 행은 제외 (스냅샷과 실제 잔액이 잠깐 어긋나는 것을 줄이기 위함)
+    cur.execute('''
+        SELECT MAX(id) AS max_id FROM rewards_history
+        WHERE created_at < LOCALTIMESTAMP - INTERVAL '1 minute'
+    ''')
+    max_id = cur.fetchone()['max_id']
+    if max_id is None:
+        return {'snapshots': 0, 'archived': 0}
+    
+    # 이전 스냅샷에 더하지 않고 (일별 합계 + max_id 까지의 내역) 으로 매번 다시 계산.
+    # 긴 트랜잭션이 max_id 보다 작은 id 를 늦게 커밋해도 다음 롤업에서 포함됨 (더하기 방식이면 영영 빠짐)
+    cur.execute('''
+        INSERT INTO rewards_balance_snapshots (user_id, balance, last_history_id, taken_at)
+        SELECT user_id, SUM(amount), %(max_id)s, LOCALTIMESTAMP
+        FROM (
+            SELECT user_id, amount FROM rewards_daily
+            UNION ALL
+            SELECT user_id, amount FROM rewards_history WHERE id <= %(max_id)s
+        ) t
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE SET
+            balance = EXCLUDED.balance,
+            last_history_id = EXCLUDED.last_history_id,
+            taken_at = EXCLUDED.taken_at
+    ''', {'max_id': max_id})
+    snapshots = cur.rowcount
+    
+    cur.execute('''
+        WITH moved AS (
+            DELETE FROM rewards_history
+            WHERE created_at < %(cutoff)s AND id <= %(max_id)s
+            RETURNING id, user_id, amount, reason, created_at
+        ),
+        archived AS (
+            INSERT INTO rewards_history_archive (id, user_id, amount, reason, created_at)
+            SELECT id, user_id, amount, reason, created_at FROM moved
+        )
+        INSERT INTO rewards_daily (user_id, day, amount, entries)
+        SELECT user_id, created_at::date, SUM(amount), COUNT(*) FROM moved
+        GROUP BY user_id, created_at::date
+        ON CONFLICT (user_id, day) DO UPDATE SET
+            amount = rewards_daily.amount + EXCLUDED.amount,
+            entries = rewards_daily.entries + EXCLUDED.entries
+        RETURNING entries
+    ''', {'cutoff': datetime.now() - timedelta(days=days), 'max_id': max_id})
+    return {'snapshots': snapshots, 'archived': sum(r['entries'] for r in cur.fetchall())}
+
+
+def run_rewards_rollup(days=REWARDS_ROLLUP_DAYS, interval=0):
+    """다른 프로세스와 겹치지 않게 롤업 → 결과
+    
+    이미 실행 중이거나, interval 을 주었을 때 그 안에 이미 롤업했으면 None.
+    """
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT pg_try_advisory_xact_lock(%s) AS locked', (REWARDS_ROLLUP_LOCK_ID,))
+        if not cur.fetchone()['locked']:
+            return None
+        if interval:
+            cur.execute('SELECT MAX(taken_at) AS last FROM rewards_balance_snapshots')
+            last = cur.fetchone()['last']
+            if last and last > datetime.now() - timedelta(seconds=interval):
+                return None
+        result = rollup_rewards(cur, days)
+        conn.commit()
+        return result
+    finally:
+        cur.close()
+        release_db(conn)
+
+
+@app.route('/api/admin/rewards/rollup', methods=['POST'])
+def admin_rollup_rewards():
+    """포인트 내역 롤업 즉시 실행 (평소에는 reaper 가 REWARDS_ROLLUP_INTERVAL 마다 실행)"""
+    try:
+        days = int((request.get_json(silent=True) or {}).get('days', REWARDS_ROLLUP_DAYS))  # 본문 없이 호출해도 됨
+    except (TypeError, ValueError):
+        days = 0
+    if days < 1:
+        # 0 이하면 기준 시각이 미래가 되어 오늘 내역까지 롤업됨
+        return jsonify({'success': False, 'message': 'days 는 1 이상의 정수'}), 400
+    
+    result = run_rewards_rollup(days)
+    if result is None:
+        return jsonify({'success': False, 'message': '다른 롤업이 진행 중입니다.'})
+    return jsonify({'success': True, **result})
+
+
+@app.route('/api/admin/rewards/ledger-check')
+def admin_ledger_check():
+    """users.rewards 와 원장(스냅샷 + 이후 내역) 대조 (user_id 없으면 불일치 유저만)"""
+    user_id = request.args.get('user_id')
+    
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        cur.execute('''
+            SELECT u.user_id, u.rewards,
+                   COALESCE(s.balance, 0) + COALESCE(l.amount, 0) AS ledger_balance,
+                   s.taken_at AS snapshot_at
+            FROM users u
+            LEFT JOIN rewards_balance_snapshots s ON s.user_id = u.user_id
+            LEFT JOIN LATERAL (
+                SELECT SUM(h.amount) AS amount FROM rewards_history h
+                WHERE h.user_id = u.user_id AND h.id > COALESCE(s.last_history_id, 0)
+            ) l ON TRUE
+            WHERE %(user_id)s::VARCHAR IS NULL OR u.user_id = %(user_id)s
+        ''', {'user_id': user_id})
+        rows = [dict(r) for r in cur.fetchall()]
+        if not user_id:
+            rows = [r for r in rows if r['rewards'] != r['ledger_balance']]
+        return jsonify({'success': True, 'users': rows})
+    finally:
+        cur.close()
+        release_db(conn)
+
+
+@app.route('/api/user/<user_id>/rewards-history')
+def rewards_history(user_id):
+    """포인트 내역 (최신순, cursor=이전 응답의 next_cursor)"""
+    cursor = decode_cursor(request.args.get('cursor'))
+    limit = max(1, min(request.args.get('limit', REWARDS_HISTORY_PAGE_SIZE, type=int), 200))
+    
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        # 최근 내역과 아카이브를 각각 인덱스로 limit 만큼만 읽어서 합침
+        page_where = 'user_id = %(user_id)s'
+        if cursor:
+            page_where += ' AND (created_at, id) < (%(created_at)s, %(id)s)'
+        cur.execute(f'''
+            SELECT * FROM (
+                (SELECT id, amount, reason, created_at FROM rewards_history
+                 WHERE {page_where} ORDER BY created_at DESC, id DESC LIMIT %(limit)s)
+                UNION ALL
+                (SELECT id, amount, reason, created_at FROM rewards_history_archive
+                 WHERE {page_where} ORDER BY created_at DESC, id DESC LIMIT %(limit)s)
+            ) h
+            ORDER BY created_at DESC, id DESC LIMIT %(limit)s
+        ''', {'user_id': user_id, 'created_at': cursor[0] if cursor else None,
+              'id': cursor[1] if cursor else None, 'limit': limit + 1})
+        rows = cur.fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+        return jsonify({'success': True, 'history': [dict(r) for r in rows], 'next_cursor': next_cursor})
+    finally:
+        cur.close()
+        release_db(conn)
+
+
+@app.route('/api/user/<user_id>/rewards-daily')
+def rewards_daily(user_id):
+    """일별 포인트 합계 (롤업된 날 + 최근 내역)"""
+    days = max(1, min(request.args.get('days', 30, type=int), 366))
+    
     conn = get_db()
     cur = conn.cursor()
     try:
-        cur.execute("SELECT COUNT(*) as c FROM uid_queue WHERE status = 'pending'")
-        pending = cur.fetchone()['c']
-        cur.execute("SELECT COUNT(*) as c FROM work_sessions WHERE last_activity > %s", (datetime.now() - timedelta(minutes=5),))
-        active = cur.fetchone()['c']
-        return jsonify({'success': True, 'pending_uids': pending, 'active_sessions': active})
+        cur.execute('''
+            SELECT day, SUM(amount) AS amount, SUM(entries) AS entries FROM (
+                SELECT day, amount, entries FROM rewards_daily
+                WHERE user_id = %(user_id)s AND day >= %(since)s
+                UNION ALL
+                SELECT created_at::date, SUM(amount), COUNT(*) FROM rewards_history
+                WHERE user_id = %(user_id)s AND created_at >= %(since)s
+                GROUP BY created_at::date
+            ) d
+            GROUP BY day ORDER BY day DESC
+        ''', {'user_id': user_id, 'since': datetime.now().date() - timedelta(days=days - 1)})
+        return jsonify({'success': True, 'daily': [
+            {'day': r['day'].isoformat(), 'amount': int(r['amount']), 'entries': int(r['entries'])}
+            for r in cur.fetchall()
+        ]})
     finally:
         cur.close()
-        conn.close()
+        release_db(conn)
+
 
+# ==================== 정리 작업 (reaper) ====================
+# 워커 프로세스마다 백그라운드 스레드가 돌지만 advisory lock 으로 한 곳에서만 실제 작업
+REAPER_ENABLED = os.environ.get('REAPER_ENABLED', '1') == '1'
+REAPER_INTERVAL = int(os.environ.get('REAPER_INTERVAL', 60))  # 실행 주기 (초)
+SESSION_IDLE_MINUTES = int(os.environ.get('SESSION_IDLE_MINUTES', 10))  # 이 시간 동안 활동 없으면 세션 만료
+REAPER_LOCK_ID = 72100005
+
+_reaper_pid = None
+_reaper_lock = threading.Lock()
+
+
+def reap(cur):
+    """오래된 세션 만료 + 그 세션이 잡고 있던 UID 반환 + 만료 리스/스크린샷/대기열 정리"""
+    cur.execute('SELECT pg_try_advisory_xact_lock(%s) AS locked', (REAPER_LOCK_ID,))
+    if not cur.fetchone()['locked']:
+        return None
+    
+    now = datetime.now()
+    cur.execute('''
+        WITH expired AS (
+            DELETE FROM work_sessions WHERE last_activity < %s
+            RETURNING user_id, current_uid_id
+        ),
+        released AS (
+            UPDATE uid_queue SET status = 'pending', lease_owner = NULL, lease_expires_at = NULL
+            WHERE id IN (SELECT current_uid_id FROM expired) AND status = 'processing'
+            RETURNING id
+        )
+        SELECT (SELECT COALESCE(json_agg(user_id), '[]') FROM expired) AS users,
+               (SELECT COALESCE(json_agg(id), '[]') FROM released) AS uids
+    ''', (now - timedelta(minutes=SESSION_IDLE_MINUTES),))
+    row = cur.fetchone()
+    result = {
+        'expired_sessions': row['users'],
+        'released_uids': row['uids'],
+        'reclaimed_leases': reclaim_expired_uids(cur),
+        'reclaimed_keywords': reclaim_expired_keywords(cur),
+        'pruned_screenshots': prune_screenshots(cur),
+    }
+    cur.execute('DELETE FROM slow_queries WHERE created_at < %s', (now - timedelta(days=SLOW_QUERY_RETENTION_DAYS),))
+    result['pruned_slow_queries'] = cur.rowcount
+    cur.execute('DELETE FROM session_queue WHERE last_seen < %s', (now - timedelta(seconds=SESSION_QUEUE_TTL),))
+    
+    for user_id in result['expired_sessions']:
+        notify(cur, 'session_update', user_id)
+    if result['expired_sessions']:
+        notify(cur, 'session_slot', '')
+    
+    if any(result.values()):
+        cur.execute('''
+            INSERT INTO reaper_runs (sessions_expired, uids_released, leases_reclaimed, screenshots_pruned, details)
+            VALUES (%s, %s, %s, %s, %s)
+        ''', (len(result['expired_sessions']), len(result['released_uids']),
+              result['reclaimed_leases'], result['pruned_screenshots'], Jsonb(result)))
+        print(f"🧹 reaper: 세션 {len(result['expired_sessions'])}개 만료, UID {len(result['released_uids'])}개 반환, "
+              f"리스 {result['reclaimed_leases']}개 회수, 키워드 {result['reclaimed_keywords']}개 회수, "
+              f"스크린샷 {result['pruned_screenshots']}개 삭제")
+    return result
+
+
+def run_reaper():
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        result = reap(cur)
+        conn.commit()
+        return result
+    finally:
+        cur.close()
+        release_db(conn)
+
+
+def _reaper_loop():
+    while True:
+        time.sleep(REAPER_INTERVAL)
+        try:
+            run_reaper()
+        except Exception as e:
+            print(f"reaper 오류: {e}")
+        if REWARDS_ROLLUP_INTERVAL and throttled('rewards_rollup', REWARDS_ROLLUP_INTERVAL):
+            try:
+                run_rewards_rollup(interval=REWARDS_ROLLUP_INTERVAL)
+            except Exception as e:
+                print(f"포인트 롤업 오류: {e}")
+
+
+@app.before_request
+def start_reaper():
+    """워커 프로세스마다 reaper 스레드 하나 (fork 후 첫 요청에서 시작)"""
+    global _reaper_pid
+    if not REAPER_ENABLED or not DATABASE_URL or _reaper_pid == os.getpid():
+        return
+    with _reaper_lock:
+        if _reaper_pid != os.getpid():
+            threading.Thread(target=_reaper_loop, name='reaper', daemon=True).start()
+            _reaper_pid = os.getpid()
+
+
+@app.route('/api/admin/reaper')
+def admin_reaper_runs():
+    """최근 정리 작업 기록"""
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT * FROM reaper_runs ORDER BY id DESC LIMIT 50')
+        return jsonify({'success': True, 'runs': [dict(r) for r in cur.fetchall()]})
+    finally:
+        cur.close()
+        release_db(conn)
+
+
+@app.route('/api/admin/reaper/run', methods=['POST'])
+def admin_run_reaper():
+    """정리 작업 즉시 실행"""
+    result = run_reaper()
+    if result is None:
+        return jsonify({'success': False, 'message': '다른 프로세스에서 실행 중입니다.'})
+    return jsonify({'success': True, **result})
+
+
+# ==================== 메트릭 엔드포인트 ====================
+METRICS_QUEUE_TTL = int(os.environ.get('METRICS_QUEUE_TTL', 15))  # 대기열 집계 캐시 (초)
+queue_depth_cache = TTLCache(METRICS_QUEUE_TTL, maxsize=1)
+
+
+def queue_depths():
+    """uid_queue / keywords 상태별 건수 (스크레이프마다 전체를 세지 않도록 캐시)"""
+    depths = queue_depth_cache.get('depths')
+    if depths is None:
+        conn = get_db()
+        cur = conn.cursor()
+        try:
+            cur.execute('SELECT status, COUNT(*) AS n FROM uid_queue GROUP BY status')
+            uids = {r['status']: r['n'] for r in cur.fetchall()}
+            cur.execute('SELECT status, COUNT(*) AS n FROM keywords GROUP BY status')
+            keywords = {r['status']: r['n'] for r in cur.fetchall()}
+            cur.execute('SELECT COUNT(*) AS n FROM session_queue')
+            waiting = cur.fetchone()['n']
+        finally:
+            cur.close()
+            release_db(conn)
+        depths = {'uids': uids, 'keywords': keywords, 'session_queue': waiting}
+        queue_depth_cache.set('depths', depths)
+    return depths
+
+
+class QueueDepthCollector:
+    """스크레이프 시점에 DB 에서 읽는 대기열 게이지 (프로세스별 값이 아니므로 합산 대상에서 제외)"""
+
+    def collect(self):
+        depths = queue_depths()
+        uids = GaugeMetricFamily('cap_api_uid_queue', '상태별 UID 수', labels=['status'])
+        for status, n in sorted(depths['uids'].items()):
+            uids.add_metric([status or ''], n)
+        keywords = GaugeMetricFamily('cap_api_keywords', '상태별 키워드 수', labels=['status'])
+        for status, n in sorted(depths['keywords'].items()):
+            keywords.add_metric([status or ''], n)
+        yield uids
+        yield keywords
+        yield GaugeMetricFamily('cap_api_session_queue', '작업자 대기열 길이', value=depths['session_queue'])
+
+
+if prometheus_client:
+    from prometheus_client import CollectorRegistry, CONTENT_TYPE_LATEST, REGISTRY, generate_latest, multiprocess
+    from prometheus_client.core import GaugeMetricFamily
+
+    queue_registry = CollectorRegistry(auto_describe=False)
+    queue_registry.register(QueueDepthCollector())
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 스크레이프 (워커 프로세스 전체 합산)"""
+    if not prometheus_client:
+        return Response('prometheus_client 가 설치되어 있지 않습니다.\n', status=503, mimetype='text/plain')
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    body = generate_latest(registry) + generate_latest(queue_registry)
+    return Response(body, content_type=CONTENT_TYPE_LATEST)
+
+
+@app.route('/api/admin/slow-queries')
+def admin_slow_queries():
+    """최근 느린 쿼리 (route=, min_ms= 로 필터, plan=1 이면 실행 계획 포함)"""
+    where, params = [], []
+    if request.args.get('route'):
+        where.append('route = %s')
+        params.append(request.args['route'])
+    if request.args.get('min_ms', type=float):
+        where.append('duration_ms >= %s')
+        params.append(request.args.get('min_ms', type=float))
+    columns = '*' if request.args.get('plan') == '1' else 'id, created_at, route, duration_ms, query, params_shape'
+    query = f'SELECT {columns} FROM slow_queries'
+    if where:
+        query += ' WHERE ' + ' AND '.join(where)
+    query += ' ORDER BY id DESC LIMIT %s'
+    params.append(min(request.args.get('limit', 100, type=int), 1000))
+    
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        cur.execute(query, params)
+        return jsonify({'success': True, 'slow_queries': [dict(r) for r in cur.fetchall()]})
+    finally:
+        cur.close()
+        release_db(conn)
+
+
+# ==================== 상태 ====================
+@app.route('/')
+def index():
+    return jsonify({'status': 'ok', 'message': '캡챠 API 서버 v2 polling'})
+
+
+@app.route('/api/status')
+def status():
+    stats, computed_at = get_dashboard_stats()
+    return jsonify({
+        'success': True,
+        'pending_uids': stats['pending_uids'],
+        'active_sessions': stats['active_sessions'],
+        'computed_at': computed_at
+    })
+
+
+if __name__ == '__main__' and sys.argv[1:] == ['migrate']:
+    migrate()
+    sys.exit()
 
 if DATABASE_URL:
     init_db()
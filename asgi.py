@@ -0,0 +1,423 @@
+"""
+캡챠 API 서버 - ASGI (asyncio) 모드
+
+작업자/봇이 계속 붙잡고 있는 세션·워커 엔드포인트
+(poll_session, check_answer, update_screenshot, submit_answer)는
+psycopg 비동기 커넥션으로 이벤트 루프에서 처리하고, 나머지 요청은 기존 Flask 앱으로 넘긴다.
+롱폴링으로 대기 중인 요청이 스레드를 차지하지 않으므로 한 노드에서 수천 개를 유지할 수 있다.
+
+    gunicorn asgi:app -c gunicorn.conf.py      # Procfile (uvicorn_worker.UvicornWorker, WEB_CONCURRENCY 개)
+"""
+
+import asyncio
+import binascii
+import hashlib
+import json
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import psycopg
+from psycopg import sql
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+from a2wsgi import WSGIMiddleware
+
+from app import app as flask_app
+from app import (
+    DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_TIMEOUT, DB_POOL_MAX_LIFETIME, DB_POOL_MAX_IDLE,
+    LONGPOLL_MAX_WAIT, POLL_SESSION_SQL, SCREENSHOT_SQL, SUBMIT_ANSWER_SQL, TAKE_ANSWER_SQL,
+    SAVE_SCREENSHOT_SQL, UPDATE_SCREENSHOT_SQL,
+    decode_screenshot, etag_version, heartbeats, screenshot_data_url, session_payload,
+    bearer_token, check_auth, notifier as sync_notifier, revocations,
+    COMPRESS_MIN_SIZE, choose_encoding, compress_body,
+    observe_db_acquire, observe_db_connect, observe_query, observe_request, query_route, trace_query,
+)
+
+ASYNC_DB_POOL_MAX_SIZE = int(os.environ.get('ASYNC_DB_POOL_MAX_SIZE', 10))
+
+
+class TimedAsyncCursor(psycopg.AsyncCursor):
+    """app.TimedCursor 의 비동기 버전"""
+
+    async def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            observe_query(query, elapsed)
+            trace_query(self, query, params, elapsed)
+
+
+class TimedAsyncConnection(psycopg.AsyncConnection):
+    @classmethod
+    async def connect(cls, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().connect(*args, **kwargs)
+        finally:
+            observe_db_connect(time.perf_counter() - start)
+
+
+pool = AsyncConnectionPool(
+    DATABASE_URL,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=ASYNC_DB_POOL_MAX_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    max_lifetime=DB_POOL_MAX_LIFETIME,
+    max_idle=DB_POOL_MAX_IDLE,
+    connection_class=TimedAsyncConnection,
+    kwargs={'row_factory': dict_row, 'cursor_factory': TimedAsyncCursor},
+    check=AsyncConnectionPool.check_connection,
+    name='cap_api_async',
+    open=False,
+)
+
+
+@asynccontextmanager
+async def connection():
+    """pool.connection() + 대기 시간 기록"""
+    start = time.perf_counter()
+    async with pool.connection() as conn:
+        observe_db_acquire(time.perf_counter() - start)
+        yield conn
+
+
+class AsyncNotifier:
+    """LISTEN 전용 비동기 커넥션 하나로 받은 NOTIFY를 대기 중인 코루틴에 전달"""
+
+    def __init__(self, channels):
+        self.channels = channels
+        self._seq = {}  # (channel, payload) -> 수신 횟수
+        self._events = {}  # (channel, payload) -> 대기 중인 코루틴들이 기다리는 Event
+        self._epoch = 0  # 재접속 횟수
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(DATABASE_URL, autocommit=True) as conn:
+                    for channel in self.channels:
+                        await conn.execute(sql.SQL('LISTEN {}').format(sql.Identifier(channel)))
+                    self._epoch += 1
+                    self._wake_all()  # 끊긴 동안 놓친 알림이 있을 수 있음
+                    while True:
+                        async for n in conn.notifies(timeout=30):
+                            self._dispatch((n.channel, n.payload))
+                        await conn.execute('SELECT 1')  # 끊긴 커넥션 감지
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"async notifier 오류: {e}")
+                await asyncio.sleep(1)
+
+    def _dispatch(self, key):
+        self._seq[key] = self._seq.get(key, 0) + 1
+        event = self._events.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def _wake_all(self):
+        events, self._events = self._events, {}
+        for event in events.values():
+            event.set()
+
+    def mark(self, key):
+        """wait()에 넘길 현재 위치 (DB 조회 전에 먼저 받아둘 것)"""
+        return (self._epoch, self._seq.get(key, 0))
+
+    async def wait(self, key, mark, timeout):
+        """mark 이후 key 알림이 오거나 timeout까지 대기"""
+        if timeout <= 0:
+            return False
+        event = self._events.get(key)
+        if event is None:
+            event = self._events[key] = asyncio.Event()
+        if self.mark(key) != mark:
+            return True
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+notifier = AsyncNotifier(['session_update', 'session_answer'])
+_started = False
+
+
+async def startup():
+    global _started
+    if not _started:
+        _started = True
+        await pool.open()
+        notifier.start()
+        await asyncio.to_thread(sync_notifier.start)  # 토큰 폐기 알림 (revocations 캐시용)
+
+
+async def shutdown():
+    await notifier.stop()
+    await pool.close()
+
+
+# ==================== 요청 / 응답 ====================
+class BadRequest(Exception):
+    """본문이 JSON 객체가 아님 → 400"""
+
+
+class Request:
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.receive = receive
+        self.args = {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode()).items()}
+        self.headers = {k.decode().lower(): v.decode() for k, v in scope.get('headers', [])}
+
+    def arg(self, name, default=None, type=str):
+        try:
+            return type(self.args[name]) if name in self.args else default
+        except ValueError:
+            return default
+
+    def if_none_match(self):
+        value = self.headers.get('if-none-match', '')
+        return [t.strip().removeprefix('W/').strip('"') for t in value.split(',') if t.strip()]
+
+    async def json(self):
+        body = b''
+        while True:
+            message = await self.receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        if not body:
+            return {}
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise BadRequest('JSON 형식 오류')
+        if not isinstance(data, dict):
+            raise BadRequest('본문은 JSON 객체여야 합니다.')
+        return data
+
+
+async def send_response(send, status=200, data=None, etag=None):
+    headers = [(b'access-control-allow-origin', b'*')]
+    body = b''
+    if data is not None:
+        body = flask_app.json.dumps(data).encode() + b'\n'
+        headers.append((b'content-type', b'application/json'))
+    headers.append((b'content-length', str(len(body)).encode()))
+    if etag:
+        headers.append((b'etag', f'"{etag}"'.encode()))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def auth_error(request, user_id, allow_user):
+    """app.auth_required 와 같은 검사 (폐기 목록을 다시 읽어야 할 때만 스레드에서 DB 조회)"""
+    token = bearer_token(request.headers.get('authorization'))
+    if token and allow_user and revocations.stale():
+        await asyncio.to_thread(revocations.refresh)
+    return check_auth(token, user_id, allow_user)
+
+
+async def send_auth_error(send, error):
+    status, message = error
+    await send_response(send, status, {'success': False, 'message': message})
+
+
+def compressing_send(send, accept_encoding):
+    """send_response 의 본문을 app.compress_response 와 같은 기준으로 압축하는 send"""
+    encoding = choose_encoding(accept_encoding)
+    start = None
+
+    async def wrapper(message):
+        nonlocal start
+        if message['type'] == 'http.response.start':
+            start = message
+            return
+        body = message.get('body', b'')
+        headers = start['headers']
+        if body and (b'content-type', b'application/json') in headers:
+            headers.append((b'vary', b'Accept-Encoding'))
+            if encoding and len(body) >= COMPRESS_MIN_SIZE:
+                body = compress_body(body, encoding)
+                headers = [h for h in headers if h[0] != b'content-length'] + [
+                    (b'content-length', str(len(body)).encode()),
+                    (b'content-encoding', encoding.encode()),
+                ]
+        await send({**start, 'headers': headers})
+        await send({**message, 'body': body})
+
+    return wrapper
+
+
+def timed_send(send, method, rule):
+    """응답 상태가 나갈 때 app.record_request_metrics 와 같은 요청 메트릭 기록"""
+    started = time.perf_counter()
+
+    async def wrapper(message):
+        if message['type'] == 'http.response.start':
+            observe_request(method, rule, message['status'], time.perf_counter() - started)
+        await send(message)
+
+    return wrapper
+
+
+# ==================== 세션 / 워커 API ====================
+async def poll_session(request, send, user_id):
+    """app.poll_session 과 같은 동작 (since / If-None-Match / wait / inline)"""
+    if error := await auth_error(request, user_id, True):
+        return await send_auth_error(send, error)
+    since = request.arg('since', type=int)
+    if since is None:
+        since = etag_version(request.if_none_match())
+    inline = request.arg('inline') == '1'
+    wait = min(request.arg('wait', 0, type=float), LONGPOLL_MAX_WAIT)
+    deadline = time.monotonic() + wait
+    key = ('session_update', user_id)
+
+    while True:
+        mark = notifier.mark(key)
+        async with connection() as conn:
+            cur = await conn.execute(POLL_SESSION_SQL, (user_id,))
+            session = await cur.fetchone()
+
+            if not session:
+                return await send_response(send, data={'success': False, 'message': '세션 없음'})
+
+            version = session['version']
+            remaining = deadline - time.monotonic()
+            if version == since and remaining <= 0:
+                heartbeats.put(user_id, datetime.now())
+                if request.if_none_match():
+                    return await send_response(send, 304, etag=f'v{version}')
+                return await send_response(send, data={'success': True, 'changed': False, 'version': version},
+                                           etag=f'v{version}')
+
+            if version != since:
+                heartbeats.put(user_id, datetime.now())
+                result = session_payload(session)
+                if inline:
+                    shot = None
+                    if session['screenshot_hash']:
+                        cur = await conn.execute(SCREENSHOT_SQL, (session['screenshot_hash'],))
+                        shot = await cur.fetchone()
+                    result['screenshot'] = screenshot_data_url(shot)
+                return await send_response(send, data=result, etag=f'v{version}')
+
+        await notifier.wait(key, mark, remaining)
+
+
+async def submit_answer(request, send):
+    data = await request.json()
+    user_id = data.get('user_id')
+    if error := await auth_error(request, user_id, True):
+        return await send_auth_error(send, error)
+    async with connection() as conn:
+        await conn.execute(SUBMIT_ANSWER_SQL, (data.get('answer'), user_id))
+        await conn.execute('SELECT pg_notify(%s, %s)', ('session_answer', user_id))
+    heartbeats.put(user_id, datetime.now())
+    await send_response(send, data={'success': True})
+
+
+async def check_answer(request, send, user_id):
+    """app.check_answer 와 같은 동작 (wait)"""
+    if error := await auth_error(request, user_id, False):
+        return await send_auth_error(send, error)
+    wait = min(request.arg('wait', 0, type=float), LONGPOLL_MAX_WAIT)
+    deadline = time.monotonic() + wait
+    key = ('session_answer', user_id)
+
+    while True:
+        mark = notifier.mark(key)
+        async with connection() as conn:
+            cur = await conn.execute(TAKE_ANSWER_SQL, (user_id,))
+            row = await cur.fetchone()
+        if row:
+            return await send_response(send, data={'success': True, 'answer': row['answer']})
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return await send_response(send, data={'success': True, 'answer': None})
+        await notifier.wait(key, mark, remaining)
+
+
+async def update_screenshot(request, send):
+    if error := await auth_error(request, None, False):
+        return await send_auth_error(send, error)
+    data = await request.json()
+    user_id = data.get('user_id')
+    screenshot = data.get('screenshot')
+
+    screenshot_hash = None
+    if screenshot:
+        try:
+            image, mime_type = decode_screenshot(screenshot)
+        except (binascii.Error, ValueError):
+            return await send_response(send, data={'success': False, 'message': '스크린샷 base64 형식 오류'})
+        screenshot_hash = hashlib.sha256(image).hexdigest()
+
+    async with connection() as conn:
+        if screenshot_hash:
+            await conn.execute(SAVE_SCREENSHOT_SQL, (screenshot_hash, image, mime_type))
+        await conn.execute(UPDATE_SCREENSHOT_SQL,
+                           (screenshot_hash, data.get('uid_id'), data.get('message', ''), user_id))
+        await conn.execute('SELECT pg_notify(%s, %s)', ('session_update', user_id))
+    await send_response(send, data={'success': True, 'screenshot_hash': screenshot_hash})
+
+
+# (메서드, Flask 와 같은 규칙 - 메트릭 라벨로도 사용, 핸들러)
+ROUTES = [
+    ('GET', '/api/session/poll/<user_id>', poll_session),
+    ('POST', '/api/session/submit-answer', submit_answer),
+    ('GET', '/api/worker/check-answer/<user_id>', check_answer),
+    ('POST', '/api/worker/update-screenshot', update_screenshot),
+]
+ROUTE_PATTERNS = [(method, re.compile('^' + re.sub(r'<[^>]+>', '([^/]+)', rule) + '$'), rule, handler)
+                  for method, rule, handler in ROUTES]
+
+wsgi_app = WSGIMiddleware(flask_app)
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] == 'http':
+        for method, pattern, rule, handler in ROUTE_PATTERNS:
+            match = pattern.match(scope['path'])
+            if match and scope['method'] == method:
+                await startup()
+                query_route.set(f'{method} {rule}')  # 느린 쿼리 기록용
+                request = Request(scope, receive)
+                send = timed_send(compressing_send(send, request.headers.get('accept-encoding')), method, rule)
+                try:
+                    return await handler(request, send, *match.groups())
+                except BadRequest as e:
+                    return await send_response(send, 400, {'success': False, 'message': str(e)})
+                except PoolTimeout:
+                    return await send_response(send, 503, {'success': False, 'message': 'DB 연결 대기 시간 초과'})
+
+    # 나머지는 기존 Flask 앱 (스레드 풀에서 실행)
+    await wsgi_app(scope, receive, send)
@@ -0,0 +1,361 @@
+"""
+캡챠 API 부하 테스트
+
+봇 N개, 작업자(solver) M명, 수집기 K개가 실제 작업 흐름대로 API 를 호출하고
+엔드포인트별 처리량 / p50·p95·p99 지연 시간 / DB 쿼리 수를 측정한다.
+
+    DATABASE_URL=postgresql://localhost/cap_bench python bench.py --bots 8 --solvers 4 --duration 30
+    python bench.py --bots 8 --solvers 4 --save before      # 결과를 bench_baselines/before.json 으로 저장
+    python bench.py --bots 8 --solvers 4 --compare before   # 저장한 기준과 비교
+
+--url 을 주지 않으면 같은 프로세스에서 서버를 띄운다 (werkzeug, 스레드).
+gunicorn/uvicorn 으로 띄운 서버를 재려면 --url http://127.0.0.1:5000 (DATABASE_URL 은 같은 DB 로).
+UID 를 실제로 리스/완료하므로 로컬·테스트용 DB 에서만 돌릴 것.
+"""
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlencode, urlsplit
+
+import psycopg
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baselines')
+ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin1234')
+SOLVER_PASSWORD = 'bench1234'
+
+
+class Stats:
+    """엔드포인트별 지연 시간 (초) / 오류 수"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.recording = False
+
+    def add(self, name, elapsed, ok):
+        if not self.recording:
+            return
+        with self._lock:
+            self.latencies.setdefault(name, []).append(elapsed)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    k = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[k]
+
+
+class Client:
+    """스레드 하나가 쓰는 keep-alive HTTP 클라이언트"""
+
+    def __init__(self, base_url, stats, token=None):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.stats = stats
+        self.token = token
+        self.conn = None
+
+    def call(self, name, method, path, body=None, params=None):
+        if params:
+            path += '?' + urlencode({k: v for k, v in params.items() if v is not None})
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        payload = json.dumps(body).encode() if body is not None else None
+
+        start = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            self.conn.request(method, path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+            raw = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self.conn = None
+            self.stats.add(name, time.perf_counter() - start, False)
+            return None
+        self.stats.add(name, time.perf_counter() - start, status < 400)
+        if status == 304 or not raw:
+            return {}
+        return json.loads(raw)
+
+
+# ==================== 시나리오 ====================
+def solver_loop(client, user_id, stop):
+    """작업 시작 → 롱폴링으로 새 캡챠 대기 → 답변 제출"""
+    while not stop.is_set():
+        r = client.call('start_session', 'POST', '/api/session/start', {'user_id': user_id, 'wait': 5})
+        if r and r.get('success'):
+            break
+    since = None
+    while not stop.is_set():
+        r = client.call('poll_session', 'GET', f'/api/session/poll/{user_id}', params={'since': since, 'wait': 2})
+        if not r or not r.get('success'):
+            time.sleep(0.1)
+            continue
+        if r.get('changed'):
+            since = r['version']
+            if r.get('screenshot_hash'):
+                client.call('submit_answer', 'POST', '/api/session/submit-answer',
+                            {'user_id': user_id, 'answer': 'bench'})
+    client.call('end_session', 'POST', '/api/session/end', {'user_id': user_id})
+
+
+def bot_loop(client, owner, solver_id, screenshot, stop):
+    """UID 리스 → 스크린샷 업로드 → 답변 대기 → 완료 (답이 없으면 반환)"""
+    while not stop.is_set():
+        r = client.call('get_pending_uid', 'GET', '/api/worker/get-pending-uid', params={'owner': owner})
+        if not r or not r.get('success'):
+            time.sleep(0.2)
+            continue
+        uid = r['uid']
+        client.call('update_screenshot', 'POST', '/api/worker/update-screenshot', {
+            'user_id': solver_id, 'screenshot': screenshot, 'uid_id': uid['id'], 'message': uid['store_name'],
+        })
+        r = client.call('check_answer', 'GET', f'/api/worker/check-answer/{solver_id}', params={'wait': 5})
+        if r and r.get('answer'):
+            client.call('complete_uid', 'POST', '/api/worker/complete-uid', {
+                'uid_id': uid['id'], 'user_id': solver_id, 'owner': owner,
+                'seller_info': {'seller_name': f"seller {uid['uid']}", 'phone': '010-0000-0000'},
+            })
+        else:
+            client.call('release_uid', 'POST', '/api/worker/release-uid', {'uid_id': uid['id']})
+
+
+def collector_loop(client, prefix, rng, batch, interval, stop):
+    """UID 등록 + 키워드 수집 주기"""
+    n = 0
+    while not stop.is_set():
+        uids = [{'uid': f'{prefix}-{n + i}', 'store_name': f'store {n + i}', 'store_url': f'https://example.com/{n + i}',
+                 'keyword': f'kw{rng.randrange(100)}'} for i in range(batch)]
+        n += batch
+        client.call('add_uids', 'POST', '/api/worker/add-uids', {'uids': uids})
+
+        r = client.call('pending_keyword', 'GET', '/api/collector/pending-keyword', params={'owner': prefix})
+        if r and r.get('success'):
+            kid = r['keyword']['id']
+            client.call('update_progress', 'POST', '/api/collector/update-progress',
+                        {'keyword_id': kid, 'collected_count': batch, 'owner': prefix})
+            client.call('complete_keyword', 'POST', '/api/collector/complete-keyword',
+                        {'keyword_id': kid, 'collected_count': batch, 'owner': prefix})
+        client.call('keywords', 'GET', '/api/keywords')
+        stop.wait(interval)
+
+
+# ==================== DB 통계 ====================
+def db_counters(database_url):
+    """pg_stat_statements 가 있으면 실행된 쿼리 수, 없으면 pg_stat_database 트랜잭션/행 수"""
+    with psycopg.connect(database_url, autocommit=True) as conn:
+        conn.execute('SELECT pg_stat_clear_snapshot()')
+        row = conn.execute('''
+            SELECT xact_commit + xact_rollback, tup_returned, tup_fetched,
+                   tup_inserted, tup_updated, tup_deleted, blks_hit, blks_read
+            FROM pg_stat_database WHERE datname = current_database()
+        ''').fetchone()
+        counters = dict(zip(['transactions', 'tup_returned', 'tup_fetched', 'tup_inserted',
+                             'tup_updated', 'tup_deleted', 'blks_hit', 'blks_read'], row))
+        try:
+            with conn.transaction():
+                counters['queries'] = conn.execute(
+                    'SELECT COALESCE(SUM(calls), 0)::bigint FROM pg_stat_statements WHERE dbid = '
+                    '(SELECT oid FROM pg_database WHERE datname = current_database())').fetchone()[0]
+        except psycopg.Error:
+            pass  # 확장이 없으면 트랜잭션 수만
+        return counters
+
+
+# ==================== 실행 ====================
+def start_local_server(args):
+    """같은 프로세스에서 app 을 werkzeug 스레드 서버로 실행 → base URL"""
+    os.environ.setdefault('MAX_WORKERS', str(args.solvers))
+    os.environ.setdefault('REAPER_ENABLED', '0')  # 측정 중 정리 작업이 끼어들지 않도록
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    import app as cap_api
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, cap_api.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def setup(base_url, stats, args, run_id):
+    """작업자 계정 생성/승인/로그인, 봇 토큰, 키워드·UID 초기 데이터"""
+    admin = Client(base_url, stats)
+    bot_token = (admin.call('admin_login', 'POST', '/api/admin/login', {'password': ADMIN_PASSWORD}) or {}).get('token')
+
+    solvers = []
+    for i in range(args.solvers):
+        user_id = f'bench{i}'
+        admin.call('register', 'POST', '/api/register', {
+            'user_id': user_id, 'password': SOLVER_PASSWORD, 'password_confirm': SOLVER_PASSWORD,
+            'name': user_id, 'phone': '010-0000-0000', 'email': f'{user_id}@example.com',
+            'bank_name': 'bench', 'bank_account': '0', 'account_holder': user_id,
+        })
+        admin.call('approve', 'POST', f'/api/admin/users/{user_id}/approve')
+        r = admin.call('login', 'POST', '/api/login', {'user_id': user_id, 'password': SOLVER_PASSWORD}) or {}
+        solvers.append((user_id, r.get('token')))
+
+    admin.call('bulk_keywords', 'POST', '/api/admin/keywords/bulk', {
+        'keywords': '\n'.join(f'{run_id}-kw{i}' for i in range(args.keywords)), 'max_count': 100,
+    })
+    seed = Client(base_url, stats, bot_token)
+    for start in range(0, args.seed_uids, 1000):
+        seed.call('add_uids', 'POST', '/api/worker/add-uids', {'uids': [
+            {'uid': f'{run_id}-seed-{n}', 'store_name': f'store {n}', 'store_url': f'https://example.com/s{n}'}
+            for n in range(start, min(start + 1000, args.seed_uids))
+        ]})
+    return solvers, bot_token
+
+
+def run(args):
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        sys.exit('DATABASE_URL 을 설정하세요 (로컬 테스트 DB).')
+
+    rng = random.Random(args.seed)
+    run_id = f'bench{args.seed}-{datetime.now():%Y%m%d%H%M%S}'
+    screenshot = base64.b64encode(b'\x89PNG\r\n\x1a\n' + rng.randbytes(args.screenshot_kb * 1024)).decode()
+    base_url = args.url or start_local_server(args)
+
+    stats = Stats()
+    solvers, bot_token = setup(base_url, stats, args, run_id)
+
+    stop = threading.Event()
+    threads = []
+    for user_id, token in solvers:
+        threads.append(threading.Thread(target=solver_loop, args=(Client(base_url, stats, token), user_id, stop)))
+    for i in range(args.bots):
+        solver_id = solvers[i % len(solvers)][0]
+        threads.append(threading.Thread(target=bot_loop, args=(
+            Client(base_url, stats, bot_token), f'{run_id}-bot{i}', solver_id, screenshot, stop)))
+    for i in range(args.collectors):
+        threads.append(threading.Thread(target=collector_loop, args=(
+            Client(base_url, stats, bot_token), f'{run_id}-c{i}', random.Random(args.seed + i),
+            args.uid_batch, args.collector_interval, stop)))
+
+    print(f'▶ {base_url} 봇 {args.bots} / 작업자 {args.solvers} / 수집기 {args.collectors}, '
+          f'워밍업 {args.warmup}초 + 측정 {args.duration}초')
+    for t in threads:
+        t.daemon = True
+        t.start()
+    time.sleep(args.warmup)
+
+    before = db_counters(database_url)
+    stats.recording = True
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    stats.recording = False
+    elapsed = time.perf_counter() - started
+    time.sleep(1)  # 통계 수집기가 반영할 시간
+    after = db_counters(database_url)
+
+    stop.set()
+    for t in threads:
+        t.join(15)
+
+    endpoints = {}
+    total = 0
+    for name, values in sorted(stats.latencies.items()):
+        values.sort()
+        total += len(values)
+        endpoints[name] = {
+            'count': len(values),
+            'errors': stats.errors.get(name, 0),
+            'rps': round(len(values) / elapsed, 2),
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+            'max_ms': round(values[-1] * 1000, 2),
+        }
+    db = {k: after[k] - before[k] for k in after if k in before}
+    if total:
+        db['per_request'] = {k: round(v / total, 2) for k, v in db.items()}
+
+    return {
+        'run_id': run_id,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'config': {k: v for k, v in vars(args).items() if k not in ('save', 'compare')},
+        'duration': round(elapsed, 2),
+        'requests': total,
+        'rps': round(total / elapsed, 2),
+        'endpoints': endpoints,
+        'db': db,
+    }
+
+
+def print_report(result, baseline=None):
+    def delta(new, old):
+        if old in (None, 0) or new is None:
+            return ''
+        return f' ({(new - old) / old * 100:+.0f}%)'
+
+    base_endpoints = baseline['endpoints'] if baseline else {}
+    print(f"\n{'endpoint':<20}{'count':>8}{'err':>6}{'rps':>16}{'p50 ms':>18}{'p95 ms':>18}{'p99 ms':>18}")
+    for name, e in result['endpoints'].items():
+        b = base_endpoints.get(name, {})
+        print(f"{name:<20}{e['count']:>8}{e['errors']:>6}"
+              f"{str(e['rps']) + delta(e['rps'], b.get('rps')):>16}"
+              f"{str(e['p50_ms']) + delta(e['p50_ms'], b.get('p50_ms')):>18}"
+              f"{str(e['p95_ms']) + delta(e['p95_ms'], b.get('p95_ms')):>18}"
+              f"{str(e['p99_ms']) + delta(e['p99_ms'], b.get('p99_ms')):>18}")
+    print(f"\n전체 {result['requests']}건, {result['rps']} req/s"
+          f"{delta(result['rps'], baseline['rps']) if baseline else ''}")
+    base_db = baseline['db'] if baseline else {}
+    for k, v in result['db'].items():
+        if k != 'per_request':
+            per = result['db'].get('per_request', {}).get(k)
+            print(f"  db {k:<14}{v:>12}  (요청당 {per}){delta(v, base_db.get(k))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='캡챠 API 부하 테스트')
+    parser.add_argument('--url', help='측정할 서버 (없으면 같은 프로세스에서 실행)')
+    parser.add_argument('--bots', type=int, default=4)
+    parser.add_argument('--solvers', type=int, default=4)
+    parser.add_argument('--collectors', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=30, help='측정 시간 (초)')
+    parser.add_argument('--warmup', type=float, default=5, help='측정 전 워밍업 (초)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--seed-uids', type=int, default=2000, help='시작 전에 넣어 둘 UID 수')
+    parser.add_argument('--keywords', type=int, default=50)
+    parser.add_argument('--uid-batch', type=int, default=100, help='수집기가 한 번에 등록하는 UID 수')
+    parser.add_argument('--collector-interval', type=float, default=1.0)
+    parser.add_argument('--screenshot-kb', type=int, default=30)
+    parser.add_argument('--save', metavar='NAME', help='결과를 bench_baselines/NAME.json 으로 저장')
+    parser.add_argument('--compare', metavar='NAME', help='bench_baselines/NAME.json 과 비교')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f'{args.compare}.json')) as f:
+            baseline = json.load(f)
+
+    result = run(args)
+    print_report(result, baseline)
+
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f'{args.save}.json')
+        with open(path, 'w') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f'\n💾 {path} 저장')
+
+
+if __name__ == '__main__':
+    main()
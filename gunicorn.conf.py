@@ -0,0 +1,40 @@
+"""
+gunicorn 설정
+
+    gunicorn asgi:app -c gunicorn.conf.py       # uvicorn 워커 (기본)
+    gunicorn app:app -c gunicorn.conf.py -k gthread --threads 2   # Flask 만 (WSGI)
+
+워커 프로세스마다 기록한 메트릭을 /metrics 에서 합산하도록 PROMETHEUS_MULTIPROC_DIR 을 준비한다.
+"""
+
+import os
+import secrets
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'uvicorn_worker.UvicornWorker')
+
+# 워커가 import 하기 전에 (마스터 프로세스에서) 설정해야 상속됨
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'cap_api_metrics'))
+# AUTH_SECRET 이 없으면 워커마다 다른 키를 만들지 않도록 마스터에서 하나 생성 (AUTH_REQUIRED=1 이면 app 이 시작을 거부)
+if os.environ.get('AUTH_REQUIRED', '0') != '1' and not os.environ.get('AUTH_SECRET'):
+    os.environ['AUTH_SECRET'] = secrets.token_hex(32)
+    print("⚠️ AUTH_SECRET 이 설정되지 않아 임의의 서명 키를 생성했습니다 (재시작하면 발급된 토큰이 무효가 됨)")
+
+
+def on_starting(server):
+    """이전 실행에서 남은 메트릭 파일 정리"""
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """종료된 워커의 live 게이지 정리"""
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)